@@ -1,8 +1,13 @@
+from pathlib import Path
+
 import click
 
+from .archive import STALE_FILE_AGE, ExportCache
+from .report import query_reports, write_reports
 from .setup_codes import codes_are_setup
 from .setup_codes import install as install_qe_codes
 from .sssp import install as setup_sssp
+from .summary import backfill_summaries as backfill_qeapp_summaries
 
 
 @click.group()
@@ -32,5 +37,120 @@ def install_sssp():
         raise click.ClickException(f"Failed to set up pseudo potentials: {error}")
 
 
+@cli.command()
+@click.option("-b", "--batch-size", type=click.IntRange(min=1), default=1000)
+@click.option("-f", "--force", is_flag=True)
+@click.option(
+    "--dry-run", is_flag=True, help="Generate the summaries, but do not store them."
+)
+def backfill_summaries(batch_size, force, dry_run):
+    verb = "Would store" if dry_run else "Stored"
+    num_stored = num_processed = 0
+    try:
+        for num_stored, num_processed, num_total in backfill_qeapp_summaries(
+            batch_size=batch_size, force=force, dry_run=dry_run
+        ):
+            click.echo(
+                f"{verb} summaries of {num_stored} work chains "
+                f"({num_processed}/{num_total} processed)."
+            )
+        if num_processed > num_stored:
+            click.echo(
+                f"The summaries of {num_processed - num_stored} work chains "
+                "cannot be generated, e.g., because their input structure is missing."
+            )
+        if not dry_run:
+            click.secho("Work chain summaries are up to date!", fg="green")
+    except Exception as error:
+        raise click.ClickException(f"Failed to backfill work chain summaries: {error}")
+
+
+@cli.command()
+@click.option(
+    "-d",
+    "--directory",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="The directory of the download archives, by default ./exports.",
+)
+@click.option(
+    "-s",
+    "--max-size",
+    type=click.IntRange(min=0),
+    help="The maximal total size of the archives in MB.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Delete stale files and the archives beyond the maximal size.",
+)
+@click.option(
+    "--max-age",
+    type=click.IntRange(min=0),
+    default=STALE_FILE_AGE,
+    show_default=True,
+    help="The age (in seconds) after which lock files and partial archives are stale.",
+)
+def export_cache(directory, max_size, prune, max_age):
+    """Report and prune the usage of the download archive cache."""
+    cache = ExportCache(
+        directory, max_size=None if max_size is None else max_size * 1024**2
+    )
+    if not cache.directory.is_dir():
+        click.echo(f"No download archives in {cache.directory}.")
+        return
+
+    try:
+        if prune:
+            for path in cache.prune(max_age=max_age):
+                click.echo(f"Deleted {path}")
+        num_archives, total_size = cache.usage()
+        click.echo(
+            f"{num_archives} archives in {cache.directory}: "
+            f"{total_size / 1024**2:.1f} MB of {cache.max_size / 1024**2:.1f} MB"
+        )
+        if not prune:
+            num_stale = len(cache.get_stale_files(max_age=max_age))
+            if num_stale:
+                click.echo(f"{num_stale} stale lock or partial archive files.")
+    except OSError as error:
+        raise click.ClickException(f"Failed to manage the download archives: {error}")
+
+
+@cli.command()
+@click.argument("output", type=click.Path(dir_okay=False, path_type=Path))
+@click.option(
+    "-g", "--group", help="Only export the work chains in the group with this label."
+)
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    help="Only export the work chains created since this date.",
+)
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "parquet"]),
+    help="The file format, by default determined from the file extension.",
+)
+@click.option("-b", "--batch-size", type=click.IntRange(min=1), default=1000)
+def export_reports(output, group, since, file_format, batch_size):
+    """Export the reports of the work chains to a CSV or Parquet file."""
+    filters = {}
+    if since is not None:
+        filters["ctime"] = {">=": since.astimezone()}
+    try:
+        num_rows = write_reports(
+            query_reports(filters=filters, group=group, batch_size=batch_size),
+            output,
+            file_format=file_format,
+            batch_size=batch_size,
+        )
+        click.secho(
+            f"Exported the reports of {num_rows} work chains to {output}.", fg="green"
+        )
+    except Exception as error:
+        raise click.ClickException(f"Failed to export the work chain reports: {error}")
+
+
 if __name__ == "__main__":
     cli()
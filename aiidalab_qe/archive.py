@@ -0,0 +1,719 @@
+"""Export of the calculation job files of QeAppWorkChain nodes as ZIP archive.
+
+The files are streamed in binary chunks from the repository straight into the
+archive, so they are neither loaded into memory nor written to disk twice.
+"""
+import hashlib
+import json
+import os
+import time
+import typing
+import warnings
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack, closing
+from dataclasses import asdict, dataclass
+from fnmatch import fnmatch
+from pathlib import Path, PurePosixPath
+from threading import Event, Lock
+
+from aiida.common import LinkType
+from aiida.manage import get_manager
+from aiida.orm import (
+    CalcJobNode,
+    Data,
+    FolderData,
+    QueryBuilder,
+    WorkChainNode,
+    load_node,
+)
+from aiida.orm.nodes.repository import NodeRepository
+from filelock import FileLock, Timeout
+
+from aiidalab_qe.cache import evict_least_recently_used
+
+__all__ = [
+    "ArchiveCancelled",
+    "ArchiveFile",
+    "ArchiveJob",
+    "ArchiveJobService",
+    "ArchiveOptions",
+    "EXPORT_PROFILES",
+    "ExportCache",
+    "estimate_archive_size",
+    "get_archive_files",
+    "get_archive_job_service",
+    "get_archive_path",
+    "get_export_dir",
+    "write_archive",
+]
+
+# The size of the chunks in which the files are copied into the archive.
+CHUNK_SIZE = 1024**2
+
+# The number of threads that read the files exported to the archive.
+EXPORT_WORKERS = 4
+
+# The maximal total size (in bytes) of the download archives in the export
+# directory, the least recently used archives are deleted beyond that.
+EXPORT_CACHE_MAX_SIZE = int(
+    os.environ.get("AIIDALAB_QE_EXPORT_CACHE_MAX_SIZE", 5 * 1024**3)
+)
+
+# Lock files and partially written archives not used for longer than this (in
+# seconds) are left over from crashed or killed kernels.
+STALE_FILE_AGE = 3600
+
+
+def get_calcjob_folders(node: WorkChainNode):
+    """Yield the archive folder names and the pw.x calculation jobs of the work chain.
+
+    The calculation jobs are retrieved with a single query, together with the
+    labels of the links from the work chain to its sub-workflows, to their base
+    workflows and to the calculation jobs of the base workflows.
+
+    :param node: QeAppWorkChain node.
+    """
+    qb = QueryBuilder()
+    qb.append(WorkChainNode, filters={"id": node.pk}, tag="top")
+    qb.append(
+        WorkChainNode,
+        with_incoming="top",
+        edge_filters={"type": LinkType.CALL_WORK.value},
+        edge_project="label",
+        edge_tag="top_link",
+        tag="sub",
+    )
+    qb.append(
+        WorkChainNode,
+        with_incoming="sub",
+        edge_filters={"type": LinkType.CALL_WORK.value},
+        edge_project="label",
+        edge_tag="base_link",
+        tag="base",
+    )
+    qb.append(
+        CalcJobNode,
+        with_incoming="base",
+        edge_filters={
+            "type": LinkType.CALL_CALC.value,
+            "label": {"like": "iteration_%"},
+        },
+        edge_project="label",
+        edge_tag="calc_link",
+        project="*",
+        tag="calcjob",
+    )
+    # The links are ordered by creation, i.e., in the order the workflows called
+    # their sub-processes.
+    qb.order_by({"top_link": "id", "base_link": "id", "calc_link": "id"})
+
+    for counter, row in enumerate(qb.iterdict(), start=1):
+        top_label = row["top_link"]["label"]
+        base_label = row["base_link"]["label"]
+        if top_label == "relax":
+            base_label = f"iter{base_label[-1]}"
+        counter_str = f"0{counter}" if counter < 10 else str(counter)
+        pw_label = f"pw{row['calc_link']['label'][-1]}"
+
+        yield f"{counter_str}-{top_label}-{base_label}-{pw_label}", row["calcjob"]["*"]
+
+
+def _walk_files(repository, path=None):
+    """Yield the paths of all files in the ``repository``, recursively."""
+    for root, _, filenames in repository.walk(path):
+        for filename in filenames:
+            yield root / filename
+
+
+@dataclass(frozen=True)
+class ArchiveFile:
+    """A repository object exported to the archive."""
+
+    # The path of the file in the archive, relative to the folder of its calcjob.
+    path: PurePosixPath
+    # The repository of the node of the object and its path in the repository.
+    repository: NodeRepository
+    object_path: PurePosixPath
+    # Whether the file is an input or an output file of the calcjob.
+    is_input: bool
+
+    @property
+    def key(self):
+        """The key of the object in the repository, which identifies its content."""
+        return self.repository.get_object(self.object_path).key
+
+    def open(self):
+        return self.repository.open(self.object_path, "rb")
+
+
+def get_calcjob_files(calcjob: CalcJobNode, pseudos, retrieved=None):
+    """Yield the ``ArchiveFile`` of the in and output files of ``calcjob``.
+
+    :param pseudos: the pseudopotential input nodes of the calcjob.
+    :param retrieved: the retrieved ``FolderData`` output of the calcjob, if any.
+    """
+    yield ArchiveFile(
+        PurePosixPath("aiida.in"),
+        calcjob.base.repository,
+        PurePosixPath(calcjob.get_option("input_filename")),
+        is_input=True,
+    )
+
+    for pseudo in pseudos:
+        yield ArchiveFile(
+            PurePosixPath("pseudo", pseudo.filename),
+            pseudo.base.repository,
+            PurePosixPath(pseudo.filename),
+            is_input=True,
+        )
+
+    if retrieved is not None:
+        repository = retrieved.base.repository
+        for path in _walk_files(repository):
+            yield ArchiveFile(path, repository, path, is_input=False)
+
+
+def get_calcjobs_files(calcjobs):
+    """Return the lists of the ``ArchiveFile`` of the in and output files of ``calcjobs``.
+
+    The pseudopotentials and the retrieved folders of all calcjobs are retrieved
+    with a single query each, instead of two queries per calcjob.
+    """
+    pks = [calcjob.pk for calcjob in calcjobs]
+    if not pks:
+        return []  # the "in" filter does not accept an empty list
+    pseudos = {pk: [] for pk in pks}
+    qb = QueryBuilder()
+    qb.append(CalcJobNode, filters={"id": {"in": pks}}, project="id", tag="calcjob")
+    qb.append(
+        Data,
+        with_outgoing="calcjob",
+        edge_filters={"type": LinkType.INPUT_CALC.value, "label": {"like": "pseudos%"}},
+        edge_project="label",
+        edge_tag="link",
+        project="*",
+        tag="pseudo",
+    )
+    qb.order_by({"link": "id"})
+    for row in qb.iterdict():
+        if row["link"]["label"].startswith("pseudos__"):
+            pseudos[row["calcjob"]["id"]].append(row["pseudo"]["*"])
+
+    qb = QueryBuilder()
+    qb.append(CalcJobNode, filters={"id": {"in": pks}}, project="id", tag="calcjob")
+    qb.append(
+        FolderData,
+        with_incoming="calcjob",
+        edge_filters={"type": LinkType.CREATE.value, "label": "retrieved"},
+        project="*",
+    )
+    retrieved = dict(qb.iterall())
+
+    return [
+        list(get_calcjob_files(calcjob, pseudos[calcjob.pk], retrieved.get(calcjob.pk)))
+        for calcjob in calcjobs
+    ]
+
+
+def get_object_sizes(keys):
+    """Return the sizes of the repository objects with the given ``keys``.
+
+    The sizes are read from the metadata of the disk object store of the profile,
+    without reading the content of the objects. For other repository backends
+    the sizes are determined by seeking to the end of the objects.
+    """
+    keys = set(keys)
+    repository = get_manager().get_profile_storage().get_repository()
+    container = getattr(repository, "_container", None)
+    if hasattr(container, "get_objects_meta"):
+        return {key: meta["size"] for key, meta in container.get_objects_meta(keys)}
+
+    sizes = {}
+    for key in keys:
+        with repository.open(key) as handle:
+            sizes[key] = handle.seek(0, os.SEEK_END)
+    return sizes
+
+
+@dataclass(frozen=True)
+class ArchiveOptions:
+    """The options of the archive of a work chain."""
+
+    # Only export the files of the final calcjob of the work chain.
+    final_calcjob_only: bool = False
+    # Export the input files (input file and pseudopotentials) of the calcjobs.
+    include_inputs: bool = True
+    # Export the retrieved output files of the calcjobs.
+    include_outputs: bool = True
+    # Glob patterns of the files to exclude, matched against the file name and the
+    # path of the file in the folder of its calcjob, e.g., "*.save/*" or "*.wfc*".
+    exclude: typing.Tuple[str, ...] = ()
+    # Exclude files larger than this size in bytes.
+    max_file_size: typing.Optional[int] = None
+    # Store files with identical content, e.g., the pseudopotentials of all calcjobs,
+    # only once in the "shared" folder of the archive. The "manifest.json" file in
+    # the folder of each calcjob maps the paths of its files to the shared files.
+    deduplicate: bool = False
+
+    @property
+    def suffix(self):
+        """The suffix of the archive name, which identifies the (non-default) options."""
+        if self == ArchiveOptions():
+            return ""
+        options = json.dumps(asdict(self), sort_keys=True)
+        return "-" + hashlib.sha256(options.encode()).hexdigest()[:8]
+
+    def is_excluded(self, file: ArchiveFile):
+        if not (self.include_inputs if file.is_input else self.include_outputs):
+            return True
+        return any(
+            fnmatch(file.path.name, pattern) or fnmatch(str(file.path), pattern)
+            for pattern in self.exclude
+        )
+
+
+# Predefined options of the archive.
+EXPORT_PROFILES = {
+    "All files": ArchiveOptions(),
+    "Final calculation only": ArchiveOptions(final_calcjob_only=True),
+    "Inputs only": ArchiveOptions(include_outputs=False),
+    "Outputs only": ArchiveOptions(include_inputs=False),
+}
+
+
+def get_archive_files(node: WorkChainNode, options=None):
+    """Return the archive names and ``ArchiveFile`` of the files exported for the work chain.
+
+    :param node: QeAppWorkChain node.
+    :param options: the ``ArchiveOptions``, by default all files are exported to
+        the folders of their calcjobs.
+    :return: tuple of a dictionary of the archive names and files and a dictionary
+        of the manifests of the calcjob folders.
+    """
+    options = options or ArchiveOptions()
+
+    folders = list(get_calcjob_folders(node))
+    if options.final_calcjob_only and folders:
+        folders = [max(folders, key=lambda folder: folder[1].ctime)]
+    calcjobs_files = get_calcjobs_files([calcjob for _, calcjob in folders])
+    entries = [
+        (folder, file)
+        for (folder, _), files in zip(folders, calcjobs_files)
+        for file in files
+        if not options.is_excluded(file)
+    ]
+
+    # The content of identical files is identified by the key of the repository
+    # object, so the files are neither read to deduplicate them nor to get their size.
+    if options.deduplicate or options.max_file_size is not None:
+        keys = [file.key for _, file in entries]
+    else:
+        keys = [None] * len(entries)
+
+    if options.max_file_size is not None:
+        sizes = get_object_sizes(keys)
+        selected = [
+            index
+            for index, key in enumerate(keys)
+            if sizes[key] <= options.max_file_size
+        ]
+        entries = [entries[index] for index in selected]
+        keys = [keys[index] for index in selected]
+
+    counts = Counter(keys) if options.deduplicate else Counter()
+    files = {}
+    manifests = {}
+    for (folder, file), key in zip(entries, keys):
+        if counts[key] > 1:
+            arcname = f"shared/{key}/{file.path.name}"
+            manifests.setdefault(folder, {})[str(file.path)] = f"../{arcname}"
+        else:
+            arcname = str(PurePosixPath(folder, file.path))
+        files.setdefault(arcname, file)
+
+    return files, manifests
+
+
+def estimate_archive_size(node: WorkChainNode, options=None):
+    """Return the number of files and their total size in bytes exported for the work chain.
+
+    The sizes are read from the metadata of the repository, the files are not read.
+    The size of the archive is (usually) smaller because the files are compressed.
+    """
+    files, _ = get_archive_files(node, options)
+    keys = {arcname: file.key for arcname, file in files.items()}
+    sizes = get_object_sizes(keys.values())
+    return len(files), sum(sizes[key] for key in keys.values())
+
+
+class ArchiveCancelled(Exception):
+    """Raised when writing an archive is cancelled."""
+
+
+def _read_ahead(executor, files, window):
+    """Open the ``files`` and read their first chunk ahead on the ``executor``.
+
+    The files are opened in the calling thread, since the lookup of the objects
+    in the repository is not thread-safe, only the reads of the open files are
+    run on the executor. At most ``window`` files are read ahead.
+
+    :return: generator of tuples of the open file, the future of its first chunk
+        and the ``ExitStack`` that closes the file.
+    """
+    pending = deque()
+    try:
+        for file in files:
+            stack = ExitStack()
+            source = stack.enter_context(file.open())
+            pending.append((source, executor.submit(source.read, CHUNK_SIZE), stack))
+            if len(pending) > window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for _, head, stack in pending:
+            wait([head])
+            stack.close()
+
+
+def write_archive(
+    node: WorkChainNode, path: Path, options=None, progress=None, cancelled=None
+):
+    """Write the ZIP archive of the calculation job files of the work chain to ``path``.
+
+    The archive is written to a temporary file next to ``path`` that is renamed
+    once complete, so that ``path`` never refers to a partially written archive.
+
+    :param node: QeAppWorkChain node.
+    :param options: the ``ArchiveOptions``, by default all files are written to
+        the folders of their calcjobs.
+    :param progress: optional function that is called with the number of files
+        written, the total number of files and the number of bytes written, after
+        each chunk written to the archive.
+    :param cancelled: optional ``threading.Event``, writing the archive is aborted
+        with an ``ArchiveCancelled`` exception once it is set.
+    """
+    path = Path(path)
+    partial_path = path.with_name(f"{path.name}.part")
+    files, manifests = get_archive_files(node, options)
+
+    bytes_written = 0
+    try:
+        with zipfile.ZipFile(
+            partial_path, "w", compression=zipfile.ZIP_DEFLATED
+        ) as zf, ThreadPoolExecutor(
+            max_workers=EXPORT_WORKERS, thread_name_prefix="archive-read"
+        ) as executor, closing(
+            _read_ahead(executor, files.values(), window=2 * EXPORT_WORKERS)
+        ) as opened:
+            # The next files are read while the current one is compressed, which
+            # releases the GIL, so that reading and compressing overlap.
+            for files_written, (arcname, (source, head, stack)) in enumerate(
+                zip(files, opened)
+            ):
+                with stack, zf.open(arcname, "w", force_zip64=True) as target:
+                    chunk = head.result()
+                    while chunk:
+                        if cancelled is not None and cancelled.is_set():
+                            raise ArchiveCancelled(f"Writing {path} was cancelled.")
+                        target.write(chunk)
+                        bytes_written += len(chunk)
+                        if progress is not None:
+                            progress(files_written, len(files), bytes_written)
+                        chunk = source.read(CHUNK_SIZE)
+                if progress is not None:
+                    progress(files_written + 1, len(files), bytes_written)
+            for folder, manifest in manifests.items():
+                zf.writestr(f"{folder}/manifest.json", json.dumps(manifest, indent=2))
+        os.replace(partial_path, path)
+    finally:
+        partial_path.unlink(missing_ok=True)
+
+
+def get_export_dir() -> Path:
+    """Return the directory in which the download archives are written.
+
+    The directory is relative to the current working directory, the directory of
+    the notebook, from which the archives are downloaded.
+    """
+    return Path.cwd().joinpath("exports")
+
+
+def get_archive_path(node: WorkChainNode, options=None, export_dir=None) -> Path:
+    """Return the path of the download archive of the work chain ``node``.
+
+    :param export_dir: the directory of the archive, by default ``get_export_dir()``.
+    """
+    options = options or ArchiveOptions()
+    return Path(export_dir or get_export_dir()).joinpath(
+        f"{node.uuid}{options.suffix}.zip"
+    )
+
+
+class ExportCache:
+    """Bounded cache of the download archives in the export directory.
+
+    The archives are evicted in least recently used order once their total size
+    exceeds ``max_size`` bytes. Lock files and partially written archives that
+    are left over from crashed kernels are removed once they are stale.
+    """
+
+    def __init__(self, directory=None, max_size=None):
+        self.directory = Path(directory or get_export_dir())
+        self.max_size = EXPORT_CACHE_MAX_SIZE if max_size is None else max_size
+
+    def get_archives(self):
+        return list(self.directory.glob("*.zip"))
+
+    def usage(self):
+        """Return the number and the total size (in bytes) of the cached archives."""
+        sizes = []
+        for path in self.get_archives():
+            try:
+                sizes.append(path.stat().st_size)
+            except FileNotFoundError:
+                continue  # deleted concurrently
+        return len(sizes), sum(sizes)
+
+    @staticmethod
+    def touch(path):
+        """Mark the archive at ``path`` as recently used."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep=()):
+        """Delete the least recently used archives until the cache is within its size.
+
+        :param keep: paths of archives that are not deleted, e.g., because they
+            were just requested. Their size still counts towards the total size.
+        :return: list of the deleted paths.
+        """
+        keep = {Path(path) for path in keep}
+        kept_size = sum(path.stat().st_size for path in keep if path.is_file())
+        return evict_least_recently_used(
+            [path for path in self.get_archives() if path not in keep],
+            max(0, self.max_size - kept_size),
+        )
+
+    def get_stale_files(self, max_age=STALE_FILE_AGE):
+        """Return the lock files and partial archives unused for ``max_age`` seconds.
+
+        Partially written archives are modified continuously while they are
+        written, lock files are only stale if they are not currently held.
+        """
+        now = time.time()
+        stale = []
+        for path in [*self.directory.glob("*.part"), *self.directory.glob("*.lock")]:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime < max_age:
+                continue
+            if path.suffix == ".lock":
+                try:
+                    with FileLock(path, timeout=0):
+                        pass
+                except Timeout:
+                    continue  # held by a running job
+                finally:
+                    # Acquiring the lock truncates the file, restore its times.
+                    os.utime(path, (stat.st_atime, stat.st_mtime))
+            stale.append(path)
+        return stale
+
+    def remove_stale_files(self, max_age=STALE_FILE_AGE):
+        """Delete the stale lock files and partial archives and return their paths."""
+        stale = self.get_stale_files(max_age)
+        for path in stale:
+            path.unlink(missing_ok=True)
+        return stale
+
+    def prune(self, max_age=STALE_FILE_AGE):
+        """Delete the stale files and evict archives beyond the size of the cache.
+
+        :return: list of the deleted paths.
+        """
+        if not self.directory.is_dir():
+            return []
+        return self.remove_stale_files(max_age) + self.evict()
+
+
+class ArchiveJob:
+    """Write the archive of a work chain in a background thread.
+
+    The job is run by the ``ArchiveJobService``. The archive is written while
+    holding a file lock, so that the same archive is never written concurrently,
+    also not by other kernels. If the archive exists once the lock is acquired,
+    e.g., because it was written by another kernel in the meantime, the job
+    completes immediately.
+    """
+
+    def __init__(self, node_uuid, path, options=None):
+        self.node_uuid = node_uuid
+        self.path = Path(path)
+        self.options = options
+        self.files_written = 0
+        self.num_files = None
+        self.bytes_written = 0
+        self.error = None
+
+        self._cancelled = Event()
+        self._done = Event()
+        self._callbacks = []
+        self._lock = Lock()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Request to cancel the job, no effect if the job is already done."""
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """Wait until the job is done and return whether it is done."""
+        return self._done.wait(timeout)
+
+    def add_callback(self, callback):
+        """Call ``callback`` with this job whenever the progress changes or it is done.
+
+        The callback is called from the thread of the job. It is called right away
+        if the job is already done.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+            done = self.done
+        if done:
+            callback(self)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def _notify(self):
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as error:
+                warnings.warn(f"Archive job callback '{callback}' failed: {error}")
+
+    def _on_progress(self, files_written, num_files, bytes_written):
+        self.files_written = files_written
+        self.num_files = num_files
+        self.bytes_written = bytes_written
+        self._notify()
+
+    def _run(self):
+        lockfile = self.path.with_suffix(".lock")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            lock = FileLock(lockfile)
+            while True:
+                if self.cancelled:
+                    raise ArchiveCancelled(f"Writing {self.path} was cancelled.")
+                try:
+                    lock.acquire(timeout=0.5)
+                    break
+                except Timeout:
+                    # Some other process is writing the archive, wait for it.
+                    continue
+            try:
+                if self.path.is_file():
+                    ExportCache.touch(self.path)
+                else:
+                    write_archive(
+                        load_node(self.node_uuid),
+                        self.path,
+                        options=self.options,
+                        progress=self._on_progress,
+                        cancelled=self._cancelled,
+                    )
+                    ExportCache(self.path.parent).evict(keep=[self.path])
+            finally:
+                lock.release()
+            lockfile.unlink(missing_ok=True)
+        except Exception as error:
+            self.error = error
+        finally:
+            self._done.set()
+            self._notify()
+
+
+class ArchiveJobService:
+    """Run the ``ArchiveJob`` of work chains in a pool of background threads.
+
+    Requests for the archive of a work chain while a job for it is pending or
+    running return that job, instead of starting another one. Jobs are only
+    kept until they are done.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="archive"
+        )
+        self._jobs = {}
+        self._lock = Lock()
+
+    def get_job(self, node: WorkChainNode, options=None, export_dir=None):
+        """Return the pending or running job for the archive of ``node`` or None."""
+        with self._lock:
+            return self._jobs.get(get_archive_path(node, options, export_dir))
+
+    def submit(self, node: WorkChainNode, options=None, export_dir=None):
+        """Return the job that writes the archive of the work chain ``node``.
+
+        A new job is started unless a job for the archive is pending or running.
+        If the archive exists, the returned job is already done.
+
+        :param options: the ``ArchiveOptions`` of the archive.
+        :param export_dir: the directory of the archive, by default ``get_export_dir()``.
+        """
+        path = get_archive_path(node, options, export_dir)
+        with self._lock:
+            job = self._jobs.get(path)
+            if job is not None:
+                return job
+            job = ArchiveJob(node.uuid, path, options)
+            exists = path.is_file()
+            if not exists:
+                self._jobs[path] = job
+        if exists:
+            # The job only marks the archive as recently used.
+            job._run()
+            return job
+        job.add_callback(self._on_job_update)
+        self._executor.submit(job._run)
+        return job
+
+    def _on_job_update(self, job):
+        if job.done:
+            job.remove_callback(self._on_job_update)
+            with self._lock:
+                if self._jobs.get(job.path) is job:
+                    del self._jobs[job.path]
+
+
+_ARCHIVE_JOB_SERVICE = None
+_ARCHIVE_JOB_SERVICE_LOCK = Lock()
+
+
+def get_archive_job_service():
+    """Return the archive job service of this kernel."""
+    global _ARCHIVE_JOB_SERVICE
+
+    with _ARCHIVE_JOB_SERVICE_LOCK:
+        if _ARCHIVE_JOB_SERVICE is None:
+            _ARCHIVE_JOB_SERVICE = ArchiveJobService()
+        return _ARCHIVE_JOB_SERVICE
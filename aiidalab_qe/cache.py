@@ -0,0 +1,141 @@
+"""On-disk cache of data derived from the (immutable) outputs of work chains."""
+import hashlib
+import json
+import os
+import warnings
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+
+__all__ = [
+    "CACHE_DIR",
+    "ResultsCache",
+]
+
+CACHE_DIR = Path(
+    os.environ.get(
+        "AIIDALAB_QE_CACHE_DIR", Path.home().joinpath(".cache", "aiidalab-qe")
+    )
+)
+
+
+def evict_least_recently_used(paths, max_size):
+    """Delete the least recently used files until their total size is below ``max_size``.
+
+    Files are last used at the later of their access and modification time. The
+    access time is not updated on file systems mounted with ``noatime``, so
+    readers of the cached files should also update their modification time.
+
+    :return: list of the deleted paths.
+    """
+    files = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # deleted concurrently
+        files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in files)
+    deleted = []
+    for _, size, path in sorted(files, key=lambda file: file[0]):
+        if total_size <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        total_size -= size
+        deleted.append(path)
+    return deleted
+
+
+def _pack(payload, arrays):
+    """Replace the NumPy arrays in ``payload`` by references to entries of ``arrays``."""
+    if isinstance(payload, np.ndarray):
+        name = f"array_{len(arrays)}"
+        arrays[name] = payload
+        return {"__array__": name}
+    elif isinstance(payload, dict):
+        return {key: _pack(value, arrays) for key, value in payload.items()}
+    elif isinstance(payload, (list, tuple)):
+        return [_pack(value, arrays) for value in payload]
+    return payload
+
+
+def _unpack(payload, arrays):
+    """Restore the NumPy arrays in ``payload`` that were replaced by ``_pack``."""
+    if isinstance(payload, dict):
+        if set(payload) == {"__array__"}:
+            return arrays[payload["__array__"]]
+        return {key: _unpack(value, arrays) for key, value in payload.items()}
+    elif isinstance(payload, list):
+        return [_unpack(value, arrays) for value in payload]
+    return payload
+
+
+class ResultsCache:
+    """Cache of JSON-like payloads with NumPy arrays in compressed ``.npz`` files.
+
+    The entries are identified by a list of strings, e.g., the UUIDs of the
+    (immutable) nodes the payload is derived from and a version of the format of
+    the payload. The least recently used entries are evicted when the total size
+    of the cache exceeds ``max_size`` bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_size=256 * 1024**2):
+        self.cache_dir = Path(cache_dir or CACHE_DIR.joinpath("results"))
+        self.max_size = max_size
+
+    def _get_path(self, key):
+        digest = hashlib.sha256("\0".join(key).encode()).hexdigest()
+        return self.cache_dir.joinpath(f"{digest}.npz")
+
+    def get(self, key):
+        """Return the cached payload for ``key`` or None if it is not cached."""
+        path = self._get_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+            payload = _unpack(json.loads(str(arrays.pop("__payload__"))), arrays)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # The entry is truncated or of an unknown format, it is recomputed.
+            path.unlink(missing_ok=True)
+            return None
+        return payload
+
+    def set(self, key, payload):
+        """Store the ``payload`` for ``key`` and evict the least recently used entries."""
+        arrays = {}
+        packed = json.dumps(_pack(payload, arrays))
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that readers never see partial files.
+        with NamedTemporaryFile(
+            dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as file:
+            try:
+                np.savez_compressed(file, __payload__=np.array(packed), **arrays)
+            except BaseException:
+                os.unlink(file.name)
+                raise
+        os.replace(file.name, self._get_path(key))
+
+        evict_least_recently_used(self.cache_dir.glob("*.npz"), self.max_size)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached payload for ``key`` or compute and cache it with ``compute()``."""
+        payload = self.get(key)
+        if payload is None:
+            payload = compute()
+            try:
+                self.set(key, payload)
+            except OSError as error:
+                warnings.warn(f"Failed to cache results: {error}")
+        return payload
+
+    def clear(self):
+        """Delete all entries of the cache."""
+        for path in self.cache_dir.glob("*.npz"):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,157 @@
+"""Per-kernel hub for process state change events.
+
+Instead of every widget polling the database for the state of "its" process in
+a dedicated thread, widgets subscribe to a single hub that receives the state
+change broadcasts of all processes and dispatches them to the subscribers.
+"""
+import warnings
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+
+import kiwipy
+from aiida.manage import get_manager
+from aiida.orm import ProcessNode, QueryBuilder
+
+__all__ = [
+    "ProcessEventHub",
+    "get_process_event_hub",
+]
+
+
+class ProcessEventHub:
+    """Dispatch process state changes to subscribed callbacks.
+
+    The state changes are received from the process state change broadcasts of
+    the given kiwipy ``communicator``, e.g., the communicator of the AiiDA
+    profile or a ``kiwipy.LocalCommunicator`` as in-process stand-in. Without
+    a communicator, a single poller thread queries the database for modified
+    processes instead. The poll interval is reset to ``min_poll_interval`` when
+    processes changed and is doubled up to ``max_poll_interval`` otherwise.
+
+    Events are dispatched from a single thread. All events that arrive while
+    the subscribers are being called are coalesced into the next dispatch.
+    """
+
+    def __init__(self, communicator=None, min_poll_interval=0.5, max_poll_interval=10):
+        self.communicator = communicator
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+
+        self._subscribers = {}
+        self._lock = Lock()
+        self._events = Queue()
+        self._threads = []
+        self._stop = Event()
+
+    def subscribe(self, callback, pk=None):
+        """Call ``callback`` with the set of pks of processes that changed state.
+
+        :param callback: function that takes the set of process pks as argument.
+        :param pk: only call ``callback`` for changes of the process with this pk,
+            by default it is called for changes of any process.
+        """
+        with self._lock:
+            self._subscribers[callback] = pk
+            if not self._threads:
+                self._start()
+
+    def unsubscribe(self, callback):
+        """Stop calling ``callback`` on process state changes."""
+        with self._lock:
+            self._subscribers.pop(callback, None)
+
+    def close(self):
+        """Stop receiving and dispatching events."""
+        self._stop.set()
+        if self.communicator is not None and self._threads:
+            self.communicator.remove_broadcast_subscriber(id(self))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _start(self):
+        self._stop.clear()
+        self._threads.append(Thread(target=self._dispatch, daemon=True))
+        if self.communicator is None:
+            self._threads.append(Thread(target=self._poll, daemon=True))
+        else:
+            self.communicator.add_broadcast_subscriber(
+                kiwipy.BroadcastFilter(self._on_broadcast, subject="state_changed.*"),
+                identifier=id(self),
+            )
+        for thread in self._threads:
+            thread.start()
+
+    def _on_broadcast(self, _communicator, _body, sender, subject, _correlation_id):
+        """Receive a state change broadcast, the sender is the pk of the process."""
+        self._events.put(sender)
+
+    def _poll(self):
+        qb = QueryBuilder().append(ProcessNode, project="mtime")
+        qb.order_by({ProcessNode: {"mtime": "desc"}}).limit(1)
+        last_modified = qb.first(flat=True)
+
+        interval = self.min_poll_interval
+        while not self._stop.wait(interval):
+            if not self._subscribers:
+                continue
+
+            filters = {} if last_modified is None else {"mtime": {">": last_modified}}
+            qb = QueryBuilder().append(
+                ProcessNode, filters=filters, project=["id", "mtime"]
+            )
+            modified = dict(qb.all())
+            if modified:
+                last_modified = max(modified.values())
+                for pk in modified:
+                    self._events.put(pk)
+                interval = self.min_poll_interval
+            else:
+                interval = min(2 * interval, self.max_poll_interval)
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            try:
+                pks = {self._events.get(timeout=1)}
+            except Empty:
+                continue
+
+            # Coalesce all events that are already queued.
+            while not self._events.empty():
+                pks.add(self._events.get())
+
+            with self._lock:
+                subscribers = list(self._subscribers.items())
+
+            for callback, pk in subscribers:
+                if pk is not None and pk not in pks:
+                    continue
+                try:
+                    callback(pks)
+                except Exception as error:
+                    warnings.warn(
+                        f"WARNING: Callback function '{callback}' unsubscribed due to error: {error}"
+                    )
+                    self.unsubscribe(callback)
+
+
+_HUB = None
+_HUB_LOCK = Lock()
+
+
+def get_process_event_hub():
+    """Return the process event hub of this kernel.
+
+    The hub subscribes to the broadcasts of the broker of the loaded AiiDA
+    profile and falls back to polling the database if no broker is available.
+    """
+    global _HUB
+
+    with _HUB_LOCK:
+        if _HUB is None:
+            try:
+                communicator = get_manager().get_communicator()
+            except Exception:
+                communicator = None
+            _HUB = ProcessEventHub(communicator=communicator)
+        return _HUB
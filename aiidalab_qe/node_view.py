@@ -5,31 +5,49 @@ Authors:
     * Carl Simon Adorf <simon.adorf@epfl.ch>
 """
 
-import json
+import os
 import random
-import shutil
 import typing
+from dataclasses import replace
+from functools import lru_cache
 from importlib import resources
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from threading import Thread
+from time import monotonic
 
 import ipywidgets as ipw
 import nglview
+import numpy as np
 import traitlets
 from aiida.cmdline.utils.common import get_workchain_report
 from aiida.common import LinkType
-from aiida.orm import CalcJobNode, Node, ProjectionData, WorkChainNode
-from aiidalab_widgets_base import ProcessMonitor, register_viewer_widget
+from aiida.engine import ProcessState
+from aiida.orm import (
+    CalcJobNode,
+    Node,
+    ProjectionData,
+    QueryBuilder,
+    WorkChainNode,
+    WorkflowNode,
+)
+from aiidalab_widgets_base import register_viewer_widget
 from aiidalab_widgets_base.viewers import StructureDataViewer
 from ase import Atoms
-from filelock import FileLock, Timeout
 from IPython.display import HTML, display
-from jinja2 import Environment
-from monty.json import jsanitize
+from jinja2 import Environment, FunctionLoader
 from traitlets import Instance, Int, List, Unicode, Union, default, observe, validate
 from widget_bandsplot import BandsPlotWidget
 
 from aiidalab_qe import static
+from aiidalab_qe.archive import (
+    EXPORT_PROFILES,
+    ArchiveCancelled,
+    estimate_archive_size,
+    get_archive_job_service,
+    get_export_dir,
+)
+from aiidalab_qe.cache import ResultsCache
+from aiidalab_qe.events import get_process_event_hub
 from aiidalab_qe.report import generate_report_dict
 
 
@@ -109,19 +127,86 @@ class MinimalStructureViewer(ipw.VBox):
                 self._viewer.add_representation("ball+stick", aspectRatio=3.5)
 
 
-def export_bands_data(work_chain_node, fermi_energy=None):
+def _format_array(array, as_lists=True):
+    """Return ``array`` as (nested) lists of floats, as expected by the
+    ``BandsPlotWidget``, or as NumPy array if not ``as_lists``.
+    """
+    return np.asarray(array).tolist() if as_lists else np.asarray(array)
+
+
+def _get_bands_plot_data(bands_data, as_lists=True):
+    """Return the plot data of a ``BandsData`` node as expected by the ``BandsPlotWidget``.
+
+    This is equivalent to the "json" export format of ``BandsData``, but the
+    plot data is built directly from the bands, k-points and labels arrays.
+    """
+    bands = bands_data.get_bands()
+    two_band_types = bands.ndim == 3
+    if two_band_types:
+        bands = np.concatenate(bands, axis=1)
+
+    try:
+        kpoints = bands_data.get_kpoints(cartesian=True)
+    except AttributeError:
+        # No cell is set, the distances are computed in reciprocal coordinates.
+        kpoints = bands_data.get_kpoints()
+    labels = list(bands_data.labels or [])
+
+    # The distance between consecutive labeled points is set to zero, these are
+    # the discontinuities of the path.
+    distances = np.linalg.norm(np.diff(kpoints, axis=0), axis=1)
+    labels_indices = np.zeros(len(kpoints), dtype=bool)
+    labels_indices[[index for index, _ in labels]] = True
+    distances[labels_indices[1:] & labels_indices[:-1]] = 0.0
+    x = np.concatenate([[0.0], np.cumsum(distances)])
+
+    path = []
+    paths = []
+    if len(labels) > 1:
+        if labels[0][0] != 0:
+            labels.insert(0, (0, ""))
+        if labels[-1][0] != len(bands) - 1:
+            labels.append((len(bands) - 1, ""))
+        segments = zip(labels[:-1], labels[1:])
+    else:
+        segments = [((0, "0"), (len(bands) - 1, "1"))]
+
+    for (position_from, label_from), (position_to, label_to) in segments:
+        if position_to - position_from > 1 or len(labels) <= 1:
+            # Segments of two consecutive points are discontinuities of the path.
+            path.append([label_from, label_to])
+        paths.append(
+            {
+                "length": position_to - position_from,
+                "from": label_from,
+                "to": label_to,
+                "values": _format_array(
+                    bands[position_from : position_to + 1].T, as_lists
+                ),
+                "x": _format_array(x[position_from : position_to + 1], as_lists),
+                "two_band_types": two_band_types,
+            }
+        )
+
+    return {
+        "label": bands_data.label,
+        "path": path,
+        "paths": paths,
+        "original_uuid": bands_data.uuid,
+    }
+
+
+def export_bands_data(work_chain_node, fermi_energy=None, as_lists=True):
     if "band_structure" in work_chain_node.outputs:
-        data = json.loads(
-            work_chain_node.outputs.band_structure._exportcontent(
-                "json", comments=False
-            )[0]
+        data = _get_bands_plot_data(
+            work_chain_node.outputs.band_structure, as_lists=as_lists
         )
         # The fermi energy from band calculation is not robust.
         data["fermi_level"] = (
             fermi_energy or work_chain_node.outputs.band_parameters["fermi_energy"]
         )
         return [
-            jsanitize(data),
+            data,
         ]
     else:
         return None
@@ -138,89 +223,144 @@ def cmap(label: str) -> str:
     return "#%06x" % random.randint(0, 0xFFFFFF)
 
 
+def _group_projections(projections: ProjectionData, curated_tags=("atom",)):
+    """Sum the PDOS of the orbitals in ``projections`` by the given tags.
+
+    All PDOS arrays are stacked into a single (orbitals x energies) matrix that is
+    multiplied with a one-hot (groups x orbitals) grouping matrix, so the PDOS of
+    all groups of all tags are computed in one pass.
+
+    :param curated_tags: the tags to group by, "atom" and/or "orbital".
+    :return: tuple of the energy array and a dictionary mapping each tag to a
+        list of (label, pdos) tuples.
+    """
+    orbitals, pdos_arrays, energy_arrays = zip(*projections.get_pdos())
+    pdos_matrix = np.stack(pdos_arrays)
+
+    orbital_names = {}
+    keys = {tag: [] for tag in curated_tags}
+    for orbital in orbitals:
+        orbital_data = orbital.get_orbital_dict()
+        kind_name = orbital_data["kind_name"]
+        quantum_numbers = (
+            orbital_data["angular_momentum"],
+            orbital_data["magnetic_number"],
+        )
+        if quantum_numbers not in orbital_names:
+            orbital_names[quantum_numbers] = orbital.get_name_from_quantum_numbers(
+                *quantum_numbers
+            ).lower()
+
+        for tag in curated_tags:
+            if tag == "atom":
+                curated_tag_var = [round(i, 2) for i in orbital_data["position"]]
+            else:
+                # by orbital label
+                curated_tag_var = orbital_names[quantum_numbers]
+            keys[tag].append(f"{kind_name}-{curated_tag_var}")
+
+    # Assign the group indices in order of first appearance of the labels.
+    labels = {}
+    group_indices = []
+    for tag in curated_tags:
+        group_labels = {}
+        group_indices.append(
+            [group_labels.setdefault(key, len(group_labels)) for key in keys[tag]]
+        )
+        labels[tag] = list(group_labels)
+    offsets = np.cumsum([0] + [len(labels[tag]) for tag in curated_tags])
+
+    grouping = np.zeros((offsets[-1], len(orbitals)), dtype=pdos_matrix.dtype)
+    for offset, indices in zip(offsets, group_indices):
+        grouping[offset + np.asarray(indices), np.arange(len(orbitals))] = 1
+    grouped_pdos = grouping @ pdos_matrix
+
+    return energy_arrays[0], {
+        tag: list(zip(labels[tag], grouped_pdos[start:stop]))
+        for start, stop, tag in zip(offsets[:-1], offsets[1:], curated_tags)
+    }
+
+
 def _projections_curated(
     projections: ProjectionData,
-    curated_tag="atom",
+    curated_tags=("atom",),
     spin_type="none",
     line_style="solid",
+    as_lists=True,
 ):
     """Collect the data from ProjectionData and parse it as dos list which can be
-    understand by bandsplot widget. `curated_tag` is for which tag to be grouped, by atom or by orbital name.
-    The spin_type is used to invert all the y values of pdos to be shown as spin down pdos and to set label."""
-    _pdos = {}
-
-    for orbital, pdos, energy in projections.get_pdos():
-        orbital_data = orbital.get_orbital_dict()
-        kind_name = orbital_data["kind_name"]
-        atom_position = [round(i, 2) for i in orbital_data["position"]]
-        orbital_name = orbital.get_name_from_quantum_numbers(
-            orbital_data["angular_momentum"], orbital_data["magnetic_number"]
-        ).lower()
+    understand by bandsplot widget. `curated_tags` are the tags to be grouped by, atom
+    and/or orbital name, the groupings by all tags are computed in one pass.
+    The spin_type is used to invert all the y values of pdos to be shown as spin down pdos and to set label.
 
-        if curated_tag == "atom":
-            curated_tag_var = atom_position
-        else:
-            # by orbital label
-            curated_tag_var = orbital_name
-
-        key = f"{kind_name}-{curated_tag_var}"
-        if key in _pdos:
-            _pdos[key][1] += pdos
-        else:
-            _pdos[key] = [energy, pdos]
-
-    dos = []
-    for label, (energy, pdos) in _pdos.items():
-        if spin_type == "down":
-            # invert y-axis
-            pdos = -pdos
-            label = f"{label} (↓)"
-
-        if spin_type == "up":
-            label = f"{label} (↑)"
-
-        orbital_pdos = {
-            "label": label,
-            "x": energy.tolist(),
-            "y": pdos.tolist(),
-            "borderColor": cmap(label),
-            "lineStyle": line_style,
-        }
-        dos.append(orbital_pdos)
+    :return: dictionary mapping each tag to the dos list grouped by the tag.
+    """
+    energy, grouped_pdos = _group_projections(projections, curated_tags=curated_tags)
+
+    dos = {}
+    for curated_tag in curated_tags:
+        dos[curated_tag] = []
+        for label, pdos in grouped_pdos[curated_tag]:
+            if spin_type == "down":
+                # invert y-axis
+                pdos = -pdos
+                label = f"{label} (↓)"
+
+            if spin_type == "up":
+                label = f"{label} (↑)"
+
+            orbital_pdos = {
+                "label": label,
+                "x": _format_array(energy, as_lists),
+                "y": _format_array(pdos, as_lists),
+                "borderColor": cmap(label),
+                "lineStyle": line_style,
+            }
+            dos[curated_tag].append(orbital_pdos)
 
     return dos
 
 
-def export_pdos_data(work_chain_node):
+def export_grouped_pdos_data(
+    work_chain_node, curated_tags=("atom", "orbital"), as_lists=True
+):
+    """Export the DOS data with the PDOS grouped by each of the ``curated_tags``.
+
+    :return: dictionary mapping each tag to the DOS data with the PDOS grouped by
+        the tag, as returned by ``export_pdos_data``, or None if there is no DOS.
+    """
     if "dos" in work_chain_node.outputs:
         _, energy_dos, _ = work_chain_node.outputs.dos.get_x()
         tdos_values = {f"{n}": v for n, v, _ in work_chain_node.outputs.dos.get_y()}
 
-        dos = []
-
         if "projections" in work_chain_node.outputs:
             # The total dos parsed
             tdos = {
                 "label": "Total DOS",
-                "x": energy_dos.tolist(),
-                "y": tdos_values.get("dos").tolist(),
+                "x": _format_array(energy_dos, as_lists),
+                "y": _format_array(tdos_values.get("dos"), as_lists),
                 "borderColor": "#8A8A8A",  # dark gray
                 "backgroundColor": "#999999",  # light gray
                 "backgroundAlpha": "40%",
                 "lineStyle": "solid",
             }
-            dos.append(tdos)
-
-            dos += _projections_curated(
-                work_chain_node.outputs.projections, spin_type="none"
-            )
+            total_dos = [tdos]
+
+            projected_dos = [
+                _projections_curated(
+                    work_chain_node.outputs.projections,
+                    curated_tags=curated_tags,
+                    spin_type="none",
+                    as_lists=as_lists,
+                )
+            ]
 
         else:
             # The total dos parsed
             tdos_up = {
                 "label": "Total DOS (↑)",
-                "x": energy_dos.tolist(),
-                "y": tdos_values.get("dos_spin_up").tolist(),
+                "x": _format_array(energy_dos, as_lists),
+                "y": _format_array(tdos_values.get("dos_spin_up"), as_lists),
                 "borderColor": "#8A8A8A",  # dark gray
                 "backgroundColor": "#999999",  # light gray
                 "backgroundAlpha": "40%",
@@ -228,43 +368,173 @@ def export_pdos_data(work_chain_node):
             }
             tdos_down = {
                 "label": "Total DOS (↓)",
-                "x": energy_dos.tolist(),
-                "y": (-tdos_values.get("dos_spin_down")).tolist(),  # minus
+                "x": _format_array(energy_dos, as_lists),
+                "y": _format_array(
+                    -tdos_values.get("dos_spin_down"), as_lists
+                ),  # minus
                 "borderColor": "#8A8A8A",  # dark gray
                 "backgroundColor": "#999999",  # light gray
                 "backgroundAlpha": "40%",
                 "lineStyle": "dash",
             }
-            dos += [tdos_up, tdos_down]
+            total_dos = [tdos_up, tdos_down]
+
+            projected_dos = [
+                # spin-up (↑)
+                _projections_curated(
+                    work_chain_node.outputs.projections_up,
+                    curated_tags=curated_tags,
+                    spin_type="up",
+                    as_lists=as_lists,
+                ),
+                # spin-dn (↓)
+                _projections_curated(
+                    work_chain_node.outputs.projections_down,
+                    curated_tags=curated_tags,
+                    spin_type="down",
+                    line_style="dash",
+                    as_lists=as_lists,
+                ),
+            ]
+
+        fermi_energy = work_chain_node.outputs.nscf_parameters["fermi_energy"]
+        return {
+            curated_tag: {
+                "fermi_energy": fermi_energy,
+                "dos": total_dos
+                + [pdos for dos in projected_dos for pdos in dos[curated_tag]],
+            }
+            for curated_tag in curated_tags
+        }
 
-            # spin-up (↑)
-            dos += _projections_curated(
-                work_chain_node.outputs.projections_up, spin_type="up"
-            )
+    else:
+        return None
 
-            # spin-dn (↓)
-            dos += _projections_curated(
-                work_chain_node.outputs.projections_down,
-                spin_type="down",
-                line_style="dash",
-            )
 
-        data_dict = {
-            "fermi_energy": work_chain_node.outputs.nscf_parameters["fermi_energy"],
-            "dos": dos,
-        }
+def export_pdos_data(work_chain_node, as_lists=True, curated_tag="atom"):
+    """Export the DOS data with the PDOS grouped by ``curated_tag``, "atom" or "orbital"."""
+    data = export_grouped_pdos_data(
+        work_chain_node, curated_tags=(curated_tag,), as_lists=as_lists
+    )
+    return data[curated_tag] if data is not None else None
 
-        return json.loads(json.dumps(data_dict))
 
-    else:
-        return None
+def _format_arrays(data):
+    """Return ``data`` with all nested NumPy arrays as (nested) lists of floats."""
+    if isinstance(data, np.ndarray):
+        return _format_array(data)
+    elif isinstance(data, dict):
+        return {key: _format_arrays(value) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [_format_arrays(value) for value in data]
+    return data
+
+
+# The outputs of the QeAppWorkChain from which the plot data is exported.
+EXPORTED_OUTPUTS = (
+    "band_structure",
+    "band_parameters",
+    "dos",
+    "nscf_parameters",
+    "projections",
+    "projections_up",
+    "projections_down",
+)
+
+# Increment the version whenever the exported data changes to invalidate the cache.
+EXPORT_DATA_VERSION = 2
+
+RESULTS_CACHE = ResultsCache()
+
+
+def _minmax_indices(values, num_buckets):
+    """Return the indices of the minimum and maximum of ``values`` in each bucket.
+
+    The values are split into ``num_buckets`` buckets of (almost) equal size and
+    the indices of the first and last value are always included, so that the
+    decimated curve preserves the peaks and the range of the original curve.
+    """
+    size = -(-len(values) // num_buckets)
+    num_full = len(values) // size
+    buckets = values[: num_full * size].reshape(num_full, size)
+    offsets = np.arange(num_full) * size
+    indices = [
+        [0, len(values) - 1],
+        offsets + buckets.argmin(axis=1),
+        offsets + buckets.argmax(axis=1),
+    ]
+    if num_full * size < len(values):
+        remainder = values[num_full * size :]
+        indices.append(
+            num_full * size + np.array([remainder.argmin(), remainder.argmax()])
+        )
+    return np.unique(np.concatenate(indices))
+
+
+def _get_window_slice(x, window):
+    """Return the slice of the sorted ``x`` within the ``window``, including the
+    points right outside of the window so that the curves reach its boundaries."""
+    start, stop = np.searchsorted(x, window)
+    return slice(max(start - 1, 0), min(stop + 1, len(x)))
+
+
+def _reduce_dos_data(dos, max_points=None, energy_range=None):
+    """Return the DOS data restricted to the energy range and downsampled with
+    min/max bucketing to at most (about) ``max_points`` points per curve."""
+    curves = []
+    for curve in dos["dos"]:
+        x, y = curve["x"], curve["y"]
+        if energy_range is not None:
+            window = _get_window_slice(
+                x, [dos["fermi_energy"] + energy_range[key] for key in ("ymin", "ymax")]
+            )
+            x, y = x[window], y[window]
+        if max_points is not None and len(x) > max_points:
+            indices = _minmax_indices(y, max(max_points // 2 - 1, 1))
+            x, y = x[indices], y[indices]
+        curves.append({**curve, "x": x, "y": y})
+    return {**dos, "dos": curves}
+
+
+def _reduce_bands_data(bands, max_points=None, energy_range=None):
+    """Return the band structure data with only the bands crossing the energy range
+    and at most (about) ``max_points`` k-points per path segment."""
+    paths = bands["paths"]
+    if energy_range is not None and not paths[0]["two_band_types"]:
+        # Drop the bands outside of the energy range, spin-polarized band structures
+        # are not reduced because the bands of both spins are distinguished by index.
+        ymin, ymax = (
+            bands["fermi_level"] + energy_range[key] for key in ("ymin", "ymax")
+        )
+        values = np.concatenate([path["values"] for path in paths], axis=1)
+        crossing = (values.max(axis=1) >= ymin) & (values.min(axis=1) <= ymax)
+        paths = [{**path, "values": path["values"][crossing]} for path in paths]
+
+    if max_points is not None:
+        decimated = []
+        for path in paths:
+            if len(path["x"]) > max_points:
+                # The bands are smooth, regular subsampling keeps their shape.
+                indices = np.unique(
+                    np.linspace(0, len(path["x"]) - 1, max_points).round().astype(int)
+                )
+                path = {
+                    **path,
+                    "x": path["x"][indices],
+                    "values": path["values"][:, indices],
+                }
+            decimated.append(path)
+        paths = decimated
+
+    return {**bands, "paths": paths}
 
 
-def export_data(work_chain_node):
-    dos = export_pdos_data(work_chain_node)
-    fermi_energy = dos["fermi_energy"] if dos else None
+def _export_data(work_chain_node):
+    # The PDOS grouped by atom and by orbital are computed in one pass.
+    dos = export_grouped_pdos_data(work_chain_node, as_lists=False)
+    fermi_energy = dos["atom"]["fermi_energy"] if dos else None
 
-    bands = export_bands_data(work_chain_node, fermi_energy)
+    bands = export_bands_data(work_chain_node, fermi_energy, as_lists=False)
 
     return dict(
         bands=bands,
@@ -272,6 +542,133 @@ def export_data(work_chain_node):
     )
 
 
+def export_data(
+    work_chain_node,
+    cache=None,
+    max_points=None,
+    energy_range=None,
+    curated_tag="atom",
+):
+    """Export the band structure and DOS data of the work chain for plotting.
+
+    The arrays are exported as lists of floats, as expected by the front end of
+    the ``BandsPlotWidget``.
+
+    :param cache: optional ``ResultsCache`` to cache the exported data in. The
+        entries are identified by the UUIDs of the work chain and of the exported
+        (immutable) outputs.
+    :param max_points: if set, the curves are downsampled to about this number of
+        points (level of detail), preserving their minima and maxima.
+    :param energy_range: if set, the curves are restricted to this energy range,
+        a dictionary with the "ymin" and "ymax" relative to the Fermi energy as
+        the ``energy_range`` of the ``BandsPlotWidget``.
+    :param curated_tag: the tag to group the PDOS by, "atom" or "orbital". Both
+        groupings are cached, so switching between them needs no recomputation.
+    """
+    if cache is not None:
+        key = [
+            f"export_data-v{EXPORT_DATA_VERSION}",
+            f"work_chain:{work_chain_node.uuid}",
+        ] + [
+            f"{label}:{work_chain_node.outputs[label].uuid}"
+            for label in EXPORTED_OUTPUTS
+            if label in work_chain_node.outputs
+        ]
+        data = cache.get_or_compute(key, lambda: _export_data(work_chain_node))
+    else:
+        data = _export_data(work_chain_node)
+    if data["dos"] is not None:
+        data["dos"] = data["dos"][curated_tag]
+
+    if max_points is not None or energy_range is not None:
+        if data["dos"] is not None:
+            data["dos"] = _reduce_dos_data(data["dos"], max_points, energy_range)
+        if data["bands"] is not None:
+            data["bands"] = [
+                _reduce_bands_data(bands, max_points, energy_range)
+                for bands in data["bands"]
+            ]
+
+    return _format_arrays(data)
+
+
+def get_called_workflow_pks(node):
+    """Return the pks of the workflow ``node`` and of the workflows it called, recursively.
+
+    The recursive joins of the ``QueryBuilder`` only follow data provenance links,
+    not CALL links, so the called workflows are queried one nesting level at a
+    time, with one query of their pks per level. None of them are loaded.
+    """
+    workflow_pks = [node.pk]
+    callers = [node.pk]
+    while callers:
+        qb = QueryBuilder()
+        qb.append(WorkflowNode, filters={"id": {"in": callers}}, tag="caller")
+        qb.append(
+            WorkflowNode,
+            with_incoming="caller",
+            edge_filters={"type": LinkType.CALL_WORK.value},
+            project="id",
+        )
+        callers = qb.all(flat=True)
+        workflow_pks.extend(callers)
+    return workflow_pks
+
+
+def get_final_calcjob(node):
+    """Return the last finished calculation job called by the workflow ``node`` or None.
+
+    The calculation job is retrieved with a single query, once the pks of the
+    called workflows are known.
+    """
+    qb = QueryBuilder()
+    qb.append(
+        WorkflowNode,
+        filters={"id": {"in": get_called_workflow_pks(node)}},
+        tag="caller",
+    )
+    qb.append(
+        CalcJobNode,
+        with_incoming="caller",
+        edge_filters={"type": LinkType.CALL_CALC.value},
+        filters={"attributes.process_state": ProcessState.FINISHED.value},
+        project="*",
+        tag="calcjob",
+    )
+    qb.order_by({"calcjob": {"ctime": "desc"}}).limit(1)
+    return qb.first(flat=True)
+
+
+def _format_size(num_bytes):
+    """Return the human readable representation of a size in bytes."""
+    units = ["B", "kB", "MB", "GB", "TB"]
+    while num_bytes >= 1000 and len(units) > 1:
+        num_bytes /= 1000
+        units.pop(0)
+    return f"{num_bytes:.3g} {units[0]}"
+
+
+def _fmt_yes_no(truthy):
+    return "Yes" if truthy else "No"
+
+
+# The templates of the result views are compiled once, when first used, and
+# are then cached by the environment.
+TEMPLATES = Environment(
+    loader=FunctionLoader(lambda name: resources.read_text(static, name))
+)
+TEMPLATES.filters.update(
+    {
+        "fmt_yes_no": _fmt_yes_no,
+    }
+)
+
+
+@lru_cache(maxsize=None)
+def get_style():
+    return resources.read_text(static, "style.css")
+
+
 class VBoxWithCaption(ipw.VBox):
     def __init__(self, caption, body, *args, **kwargs):
         super().__init__(children=[ipw.HTML(caption), body], *args, **kwargs)
@@ -282,21 +679,12 @@ class SummaryView(ipw.VBox):
 
         self.wc_node = wc_node
 
-        def _fmt_yes_no(truthy):
-            return "Yes" if truthy else "No"
-
         report = generate_report_dict(self.wc_node)
 
-        env = Environment()
-        env.filters.update(
-            {
-                "fmt_yes_no": _fmt_yes_no,
-            }
-        )
-        template = resources.read_text(static, "workflow_summary.jinja")
-        style = resources.read_text(static, "style.css")
         self.summary_view = ipw.HTML(
-            env.from_string(template).render(style=style, **report)
+            TEMPLATES.get_template("workflow_summary.jinja").render(
+                style=get_style(), **report
+            )
         )
         super().__init__(
             children=[self.summary_view],
@@ -309,25 +697,91 @@ class WorkChainOutputs(ipw.VBox):
     _busy = traitlets.Bool(read_only=True)
 
     def __init__(self, node, export_dir=None, **kwargs):
-        self.export_dir = Path.cwd().joinpath("exports")
-
         if node.process_label != "QeAppWorkChain":
             raise KeyError(str(node.node_type))
 
         self.node = node
-
-        self._create_archive_indicator = ipw.HTML(
-            """<button disabled>
-                <i class="fa fa-spinner fa-spin" aria-hidden="true"></i>
-                    Creating archive...
-            </button>"""
+        # The archives are downloaded with links relative to the directory of the
+        # notebook, the working directory when the widget is created.
+        self._notebook_dir = Path.cwd()
+        self.export_dir = Path(export_dir) if export_dir else get_export_dir()
+
+        self._archive_progress = ipw.FloatProgress(
+            min=0,
+            max=1,
+            description="Creating archive...",
+            style={"description_width": "initial"},
+        )
+        self._archive_progress_info = ipw.HTML()
+        self._cancel_archive_button = ipw.Button(
+            description="Cancel",
+            icon="times",
+            layout=ipw.Layout(width="auto"),
+        )
+        self._cancel_archive_button.on_click(self._cancel_archive)
+        self._create_archive_indicator = ipw.HBox(
+            [
+                self._archive_progress,
+                self._archive_progress_info,
+                self._cancel_archive_button,
+            ]
         )
         self._download_archive_button = ipw.Button(
             description="Download output",
             icon="download",
         )
         self._download_archive_button.on_click(self._download_archive)
-        self._download_button_container = ipw.Box([self._download_archive_button])
+        self._download_archive_info = ipw.HTML()
+        self._download_button_container = ipw.HBox(
+            [self._download_archive_info, self._download_archive_button]
+        )
+
+        self._export_profile_dropdown = ipw.Dropdown(
+            options=list(EXPORT_PROFILES),
+            description="Files:",
+            layout=ipw.Layout(width="auto"),
+        )
+        self._exclude_text = ipw.Text(
+            placeholder="e.g. *.wfc*, *.hub*",
+            description="Exclude:",
+            continuous_update=False,
+            layout=ipw.Layout(width="auto"),
+        )
+        self._max_file_size_text = ipw.BoundedFloatText(
+            value=0,
+            min=0,
+            max=1e6,
+            description="Max. file size (MB):",
+            style={"description_width": "initial"},
+            layout=ipw.Layout(width="200px"),
+        )
+        self._deduplicate_checkbox = ipw.Checkbox(
+            value=False,
+            description="Store identical files (e.g. pseudopotentials) only once",
+            indent=False,
+            layout=ipw.Layout(width="auto"),
+        )
+        self._archive_estimate_info = ipw.HTML()
+        for widget in (
+            self._export_profile_dropdown,
+            self._exclude_text,
+            self._max_file_size_text,
+            self._deduplicate_checkbox,
+        ):
+            widget.observe(self._update_archive_estimate, "value")
+        self._archive_options = ipw.HBox(
+            [
+                self._export_profile_dropdown,
+                self._exclude_text,
+                self._max_file_size_text,
+                self._deduplicate_checkbox,
+                self._archive_estimate_info,
+            ],
+            layout=ipw.Layout(margin="0px 10px", flex_flow="row wrap"),
+        )
+        self._archive_job = None
+        self._archive_estimate_options = None
+        self._last_progress_update = 0
 
         if node.exit_status != 0:
 
@@ -335,12 +789,9 @@ class WorkChainOutputs(ipw.VBox):
                 f"<h4>Workflow failed with exit status [{ node.exit_status }]</h4>"
             )
             final_calcjob = self._get_final_calcjob(node)
-            env = Environment()
-            template = resources.read_text(static, "workflow_failure.jinja")
-            style = resources.read_text(static, "style.css")
             output = ipw.HTML(
-                env.from_string(template).render(
-                    style=style,
+                TEMPLATES.get_template("workflow_failure.jinja").render(
+                    style=get_style(),
                     process_report=get_workchain_report(node, "REPORT"),
                     calcjob_exit_message=final_calcjob.exit_message,
                 )
@@ -355,49 +806,126 @@ class WorkChainOutputs(ipw.VBox):
                     children=[title, self._download_button_container],
                     layout=ipw.Layout(justify_content="space-between", margin="10px"),
                 ),
+                self._archive_options,
                 output,
             ],
             **kwargs,
         )
 
+        self._update_archive_estimate()
+
+        # Follow the job if the archive is already being created, e.g., pre-built.
+        job = get_archive_job_service().get_job(
+            node, self._get_archive_options(), self.export_dir
+        )
+        if job is not None and not job.done:
+            self._follow_archive_job(job)
+
     @traitlets.default("_busy")
     def _default_busy(self):
         return False
 
     @traitlets.observe("_busy")
     def _observe_busy(self, change):
-        self._download_button_container.children = [
-            self._create_archive_indicator
+        self._download_button_container.children = (
+            [self._create_archive_indicator]
             if change["new"]
-            else self._download_archive_button
-        ]
+            else [self._download_archive_info, self._download_archive_button]
+        )
+        self._archive_options.layout.visibility = (
+            "hidden" if change["new"] else "visible"
+        )
+
+    def _get_archive_options(self):
+        exclude = tuple(
+            pattern.strip()
+            for pattern in self._exclude_text.value.split(",")
+            if pattern.strip()
+        )
+        max_file_size = int(self._max_file_size_text.value * 1024**2) or None
+        return replace(
+            EXPORT_PROFILES[self._export_profile_dropdown.value],
+            exclude=exclude,
+            max_file_size=max_file_size,
+            deduplicate=self._deduplicate_checkbox.value,
+        )
+
+    def _update_archive_estimate(self, _=None):
+        """Show the size of the archive, as estimated from the file metadata.
+
+        The estimate is computed in the background, so that it does not delay
+        showing the outputs. Only the estimate of the latest options is shown.
+        """
+        options = self._get_archive_options()
+        self._archive_estimate_options = options
+        self._archive_estimate_info.value = "<i>Estimating size...</i>"
+
+        def estimate():
+            try:
+                num_files, num_bytes = estimate_archive_size(self.node, options)
+                info = f"<i>{num_files} files, {_format_size(num_bytes)} (uncompressed)</i>"
+            except Exception as error:
+                info = f"<i>Failed to estimate size: {error}</i>"
+            if self._archive_estimate_options == options:
+                self._archive_estimate_info.value = info
+
+        Thread(target=estimate, daemon=True).start()
 
     def _download_archive(self, _):
+        job = get_archive_job_service().submit(
+            self.node, self._get_archive_options(), self.export_dir
+        )
+        if job.done and job.error is None:
+            self._trigger_download(job.path)
+        else:
+            # The archive is created in the background, the download link is
+            # shown once the archive is complete.
+            self._follow_archive_job(job)
+
+    def _cancel_archive(self, _):
+        if self._archive_job is not None:
+            self._archive_job.cancel()
+
+    def _follow_archive_job(self, job):
+        self._archive_job = job
+        self._archive_progress.value = 0
+        self._archive_progress_info.value = ""
+        self._download_archive_info.value = ""
+        self.set_trait("_busy", True)
+        job.add_callback(self._on_archive_job_update)
+
+    def _on_archive_job_update(self, job):
+        if not job.done:
+            # Limit the rate of the updates of the progress widgets.
+            if monotonic() - self._last_progress_update > 0.2 and job.num_files:
+                self._last_progress_update = monotonic()
+                self._archive_progress.value = job.files_written / job.num_files
+                self._archive_progress_info.value = (
+                    f"{job.files_written}/{job.num_files} files "
+                    f"({_format_size(job.bytes_written)})"
+                )
+            return
+
+        job.remove_callback(self._on_archive_job_update)
+        if isinstance(job.error, ArchiveCancelled):
+            self._download_archive_info.value = "Archive creation cancelled."
+        elif job.error is not None:
+            self._download_archive_info.value = (
+                f"<span style='color: red'>Failed to create archive: {job.error}</span>"
+            )
+        else:
+            self._download_archive_info.value = (
+                f'<a href="{self._get_href(job.path)}" '
+                f'download="{job.path.stem}">'
+                f"Archive ready ({_format_size(job.path.stat().st_size)})</a>"
+            )
+        self.set_trait("_busy", False)
 
-        fn_archive = self.export_dir.joinpath(str(self.node.uuid)).with_suffix(".zip")
-        fn_lockfile = fn_archive.with_suffix(".lock")
-
-        try:
-            self.set_trait("_busy", True)
-            # Create exports archive directory.
-            fn_archive.parent.mkdir(parents=True, exist_ok=True)
-            # Try to obtain lock for creating archive...
-            with FileLock(fn_lockfile, timeout=0):
-                # Check whether archive file already exists.
-                if not fn_archive.is_file():
-                    # Create archive file.
-                    with TemporaryDirectory() as tmpdir:
-                        self._prepare_calcjob_io(self.node, Path(tmpdir))
-                        shutil.make_archive(fn_archive.with_suffix(""), "zip", tmpdir)
-            Path(fn_lockfile).unlink()  # Delete lock file.
-        except Timeout:
-            # Failed to obtain lock, presuming some other process is working on it.
-            with FileLock(fn_lockfile, timeout=20):
-                assert fn_archive.is_file()
-        finally:
-            self.set_trait("_busy", False)
-
-        id = f"dl_{self.node.uuid}"
+    def _get_href(self, path):
+        return Path(os.path.relpath(path, self._notebook_dir)).as_posix()
+
+    def _trigger_download(self, fn_archive):
+        id = f"dl_{fn_archive.stem}"
 
         display(
             HTML(
@@ -406,7 +934,7 @@ class WorkChainOutputs(ipw.VBox):
         <body>
         <a
             id="{id}"
-            href="{fn_archive.relative_to(Path.cwd())}"
+            href="{self._get_href(fn_archive)}"
             download="{fn_archive.stem}"
         ></a>
         <script>
@@ -420,96 +948,37 @@ class WorkChainOutputs(ipw.VBox):
             )
         )
 
-    @classmethod
-    def _prepare_calcjob_io(cls, node: WorkChainNode, root_folder: Path):
-        """Prepare the calculation job input and output files.
-
-        :param node: QeAppWorkChain node.
-        """
-        counter = 1
-
-        for link1 in node.get_outgoing(link_type=LinkType.CALL_WORK):
-            wc_node = link1.node
-            for link2 in wc_node.get_outgoing(link_type=LinkType.CALL_WORK):
-                base_node = link2.node
-                base_label = (
-                    f"iter{link2.link_label[-1]}"
-                    if link1.link_label == "relax"
-                    else link2.link_label
-                )
-                for link3 in base_node.get_outgoing(
-                    link_type=LinkType.CALL_CALC, link_label_filter="iteration_%"
-                ):
-                    counter_str = f"0{counter}" if counter < 10 else str(counter)
-                    pw_label = f"pw{link3.link_label[-1]}"
-
-                    fdname = f"{counter_str}-{link1.link_label}-{base_label}-{pw_label}"
-
-                    folder_path = root_folder / fdname
-
-                    cls._write_calcjob_io(link3.node, folder_path)
-
-                    counter += 1
-
     @staticmethod
     def _get_final_calcjob(node: WorkChainNode) -> typing.Union[None, CalcJobNode]:
         """Get the final calculation job node called by a work chain node.
 
         :param node: Work chain node.
         """
-        try:
-            final_calcjob = [
-                process
-                for process in node.called_descendants
-                if isinstance(process, CalcJobNode) and process.is_finished
-            ][-1]
-        except IndexError:
-            final_calcjob = None
-
-        return final_calcjob
-
-    @staticmethod
-    def _write_calcjob_io(calcjob: CalcJobNode, folder: Path) -> None:
-        """Write the ``calcjob`` in and output files to ``folder``.
-
-        :param calcjob: calculation job node for which to write the IO files.
-        :param folder: folder to which to write the IO files.
-        """
-        folder.mkdir(exist_ok=True)
-        input_filepath = folder / "aiida.in"
-
-        with calcjob.open(calcjob.get_option("input_filename"), "r") as ihandle:
-            with input_filepath.open("w") as ohandle:
-                ohandle.write(ihandle.read())
-
-        pseudo_folder = folder / "pseudo"
-        pseudo_folder.mkdir(exist_ok=True)
-
-        for _, pseudo in calcjob.inputs.pseudos.items():
-
-            pseudo_path = pseudo_folder / pseudo.filename
-
-            with pseudo_path.open("w") as handle:
-                handle.write(pseudo.get_content())
-
-        retrieved = calcjob.outputs.retrieved
-
-        for filename in retrieved.list_object_names():
-            out_filepath = folder / filename
-            with out_filepath.open("w") as handle:
-                handle.write(retrieved.get_object_content(filename))
+        return get_final_calcjob(node)
 
 
 @register_viewer_widget("process.workflow.workchain.WorkChainNode.")
 class WorkChainViewer(ipw.VBox):
 
+    # The results that are available and the results whose tab was built.
+    _results_available = traitlets.Set()
     _results_shown = traitlets.Set()
 
+    # The maximal number of points per curve sent to the electronic structure plot.
+    PLOT_MAX_POINTS = 2000
+
+    # The index and title of the tab of each result, the tabs are built once selected.
+    RESULT_TABS = {
+        "structure": (1, "Final Geometry"),
+        "electronic_structure": (2, "Electronic Structure"),
+    }
+
     def __init__(self, node, **kwargs):
         if node.process_label != "QeAppWorkChain":
             raise KeyError(str(node.node_type))
 
         self.node = node
+        self._structure_view = None
 
         self.title = ipw.HTML(
             f"""
@@ -538,72 +1007,162 @@ class WorkChainViewer(ipw.VBox):
         self.result_tabs.set_title(1, "Final Geometry (n/a)")
         self.result_tabs.set_title(2, "Electronic Structure (n/a)")
 
-        # An ugly fix to the structure appearance problem
-        # https://github.com/aiidalab/aiidalab-qe/issues/69
-        def on_selected_index_change(change):
-            index = change["new"]
-            # Accessing the viewer only if the corresponding tab is present.
-            if self.result_tabs._titles[str(index)] == "Final Geometry":
-                self._structure_view._viewer.handle_resize()
-
-                def toggle_camera():
-                    """Toggle camera between perspective and orthographic."""
-                    self._structure_view._viewer.camera = (
-                        "perspective"
-                        if self._structure_view._viewer.camera == "orthographic"
-                        else "orthographic"
-                    )
-
-                toggle_camera()
-                toggle_camera()
-
-        self.result_tabs.observe(on_selected_index_change, "selected_index")
+        self.result_tabs.observe(self._on_selected_index_change, "selected_index")
         self._update_view()
 
         super().__init__(
             children=[self.title, self.result_tabs],
             **kwargs,
         )
-        self._process_monitor = ProcessMonitor(
-            process=self.node,
-            callbacks=[
-                self._update_view,
-            ],
-        )
+        if not self.node.is_sealed:
+            get_process_event_hub().subscribe(
+                self._on_process_state_change, pk=self.node.pk
+            )
+
+    def _on_process_state_change(self, _=None):
+        if self.node.is_sealed:
+            get_process_event_hub().unsubscribe(self._on_process_state_change)
+        self._update_view()
 
     def _update_view(self):
         with self.hold_trait_notifications():
             if self.node.is_finished:
                 self._show_workflow_output()
             if (
-                "structure" not in self._results_shown
+                "structure" not in self._results_available
                 and "structure" in self.node.outputs
             ):
-                self._show_structure()
-                self._results_shown.add("structure")
+                self._set_result_available("structure")
 
-            if "electronic_structure" not in self._results_shown and (
+            if "electronic_structure" not in self._results_available and (
                 "band_structure" in self.node.outputs or "dos" in self.node.outputs
             ):
-                self._show_electronic_structure()
-                self._results_shown.add("electronic_structure")
+                self._set_result_available("electronic_structure")
+
+    def _set_result_available(self, result):
+        """Enable the tab of the ``result``, which is only built once selected."""
+        index, title = self.RESULT_TABS[result]
+        self._results_available.add(result)
+        self.result_tabs.children[index].children = [
+            ipw.Label(f"Select the tab to show the {title.lower()}.")
+        ]
+        self.result_tabs.set_title(index, title)
+        if self.result_tabs.selected_index == index:
+            self._load_result(result)
+
+    def _on_selected_index_change(self, change):
+        for result, (index, _) in self.RESULT_TABS.items():
+            if change["new"] == index and result in self._results_available:
+                self._load_result(result)
+
+        # An ugly fix to the structure appearance problem
+        # https://github.com/aiidalab/aiidalab-qe/issues/69
+        if change["new"] == self.RESULT_TABS["structure"][0]:
+            self._refresh_structure_view()
+
+    def _load_result(self, result):
+        """Build the view of the ``result`` in a background thread, once."""
+        if result in self._results_shown:
+            return
+        self._results_shown.add(result)
+
+        index, title = self.RESULT_TABS[result]
+        self.result_tabs.children[index].children = [
+            ipw.HTML(
+                f'<i class="fa fa-spinner fa-spin"></i> Loading the {title.lower()}...'
+            )
+        ]
+        show = {
+            "structure": self._show_structure,
+            "electronic_structure": self._show_electronic_structure,
+        }[result]
+
+        def prepare_and_show():
+            try:
+                show()
+            except Exception as error:
+                self.result_tabs.children[index].children = [
+                    ipw.HTML(
+                        "<span style='color: red'>"
+                        f"Failed to show the {title.lower()}: {error}</span>"
+                    )
+                ]
+
+        Thread(target=prepare_and_show, daemon=True).start()
+
+    def _refresh_structure_view(self):
+        if self._structure_view is None:
+            return
+
+        self._structure_view._viewer.handle_resize()
+
+        def toggle_camera():
+            """Toggle camera between perspective and orthographic."""
+            self._structure_view._viewer.camera = (
+                "perspective"
+                if self._structure_view._viewer.camera == "orthographic"
+                else "orthographic"
+            )
+
+        toggle_camera()
+        toggle_camera()
 
     def _show_structure(self):
         self._structure_view = StructureDataViewer(
             structure=self.node.outputs.structure
         )
         self.result_tabs.children[1].children = [self._structure_view]
-        self.result_tabs.set_title(1, "Final Geometry")
+        if self.result_tabs.selected_index == 1:
+            self._refresh_structure_view()
 
     def _show_electronic_structure(self):
-        data = export_data(self.node)
+        self._energy_range = ipw.FloatRangeSlider(
+            value=[-10.0, 10.0],
+            min=-30.0,
+            max=30.0,
+            step=0.5,
+            description="Energy range (eV):",
+            continuous_update=False,
+            style={"description_width": "initial"},
+            layout=ipw.Layout(width="500px"),
+        )
+        self._energy_range.observe(self._on_energy_range_change, "value")
+        self._bands_plot_view = self._create_bands_plot_view()
+        self.result_tabs.children[2].children = [
+            self._energy_range,
+            self._bands_plot_view,
+        ]
+
+    def _create_bands_plot_view(self):
+        ymin, ymax = self._energy_range.value
+        energy_range = {"ymin": ymin, "ymax": ymax}
+
+        # Only the data within the selected energy range is sent to the front end,
+        # downsampled to the resolution of the plot. The front end of the
+        # BandsPlotWidget does not report zooming, so the plot is recreated with
+        # the data of the new range whenever the energy range is selected.
+        data = export_data(
+            self.node,
+            cache=RESULTS_CACHE,
+            max_points=self.PLOT_MAX_POINTS,
+            energy_range=energy_range,
+        )
         bands_data = data.get("bands", None)
         dos_data = data.get("dos", None)
-        self._bands_plot_view = BandsPlotWidget(
-            bands=bands_data, dos=dos_data, plot_fermilevel=True
+        return BandsPlotWidget(
+            bands=bands_data,
+            dos=dos_data,
+            plot_fermilevel=True,
+            energy_range=energy_range,
         )
-        self.result_tabs.children[2].children = [self._bands_plot_view]
-        self.result_tabs.set_title(2, "Electronic Structure")
+
+    def _on_energy_range_change(self, _):
+        self._bands_plot_view.close()
+        self._bands_plot_view = self._create_bands_plot_view()
+        self.result_tabs.children[2].children = [
+            self._energy_range,
+            self._bands_plot_view,
+        ]
 
     def _show_workflow_output(self):
         self.workflows_output = WorkChainOutputs(self.node)
@@ -1,7 +1,25 @@
+from copy import deepcopy
+from functools import lru_cache
 from importlib import resources
 
 import yaml
+from aiida.plugins import WorkflowFactory
 
 from aiidalab_qe import parameters
 
 DEFAULT_PARAMETERS = yaml.safe_load(resources.read_text(parameters, "qeapp.yaml"))
+
+
+@lru_cache(maxsize=None)
+def _get_protocol_inputs(protocol):
+    PwBaseWorkChain = WorkflowFactory("quantumespresso.pw.base")
+    return PwBaseWorkChain.get_protocol_inputs(protocol)
+
+
+def get_protocol_inputs(protocol=None):
+    """Return the inputs of the ``PwBaseWorkChain`` for the ``protocol``.
+
+    The protocol file is only parsed once for each protocol. A copy of the
+    inputs is returned, so that they can be modified by the caller.
+    """
+    return deepcopy(_get_protocol_inputs(protocol))
@@ -0,0 +1,154 @@
+"""Polling of many sources, e.g., the output files of calculation jobs, from a few threads.
+
+Each source is polled at an interval adapted to its activity: as fast as allowed
+while it changes, backing off exponentially while it does not change, and only
+rarely while it is waiting, e.g., while a calculation job is queued. The total
+rate of polls is capped, so the load does not grow with the number of sources.
+"""
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from threading import Condition, Lock, Thread
+from time import monotonic
+
+__all__ = [
+    "PollResult",
+    "PollScheduler",
+    "get_poll_scheduler",
+]
+
+
+class PollResult(Enum):
+    """The result of a poll, which determines when the source is polled next."""
+
+    CHANGED = "changed"
+    UNCHANGED = "unchanged"
+    WAITING = "waiting"
+    DONE = "done"
+
+
+class PollTask:
+    """A source that is polled by a ``PollScheduler``."""
+
+    def __init__(self, poll, interval):
+        self.poll = poll
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop polling the source, a poll that is in progress is completed."""
+        self.cancelled = True
+
+
+class PollScheduler:
+    """Poll the sources added with ``add`` on a small pool of worker threads.
+
+    The poll function of a source is called without arguments and returns a
+    ``PollResult``: the source is polled again after ``min_interval`` seconds if
+    it CHANGED, after twice the previous interval (up to ``max_interval``) if it
+    is UNCHANGED, after ``waiting_interval`` seconds if it is WAITING, and no
+    more if it is DONE. A source is never polled concurrently with itself, and
+    at most ``max_polls_per_second`` polls are started in total.
+    """
+
+    def __init__(
+        self,
+        max_workers=4,
+        max_polls_per_second=20,
+        min_interval=0.2,
+        max_interval=10.0,
+        waiting_interval=30.0,
+    ):
+        self.max_polls_per_second = max_polls_per_second
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.waiting_interval = waiting_interval
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="poll"
+        )
+        self._queue = []  # heap of (due time, sequence number, task)
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._dispatcher = None
+
+    def add(self, poll):
+        """Start polling a source with the function ``poll``, immediately.
+
+        :return: the ``PollTask`` of the source, to cancel polling it.
+        """
+        task = PollTask(poll, self.min_interval)
+        self._schedule(task, 0)
+        return task
+
+    def _schedule(self, task, delay):
+        with self._condition:
+            heapq.heappush(
+                self._queue, (monotonic() + delay, next(self._counter), task)
+            )
+            if self._dispatcher is None:
+                self._dispatcher = Thread(target=self._dispatch, daemon=True)
+                self._dispatcher.start()
+            self._condition.notify()
+
+    def _dispatch(self):
+        """Start the polls that are due, no more than ``max_polls_per_second``."""
+        last_start = float("-inf")
+        while True:
+            with self._condition:
+                while True:
+                    now = monotonic()
+                    # Drop the cancelled tasks, instead of waiting for them.
+                    while self._queue and self._queue[0][2].cancelled:
+                        heapq.heappop(self._queue)
+                    if self._queue:
+                        due = max(
+                            self._queue[0][0],
+                            last_start + 1 / self.max_polls_per_second,
+                        )
+                        if due <= now:
+                            break
+                        self._condition.wait(due - now)
+                    else:
+                        self._condition.wait()
+                _, _, task = heapq.heappop(self._queue)
+            last_start = now
+            self._executor.submit(self._run, task)
+
+    def _run(self, task):
+        try:
+            result = task.poll()
+        except Exception:
+            # The poll function is responsible for reporting its errors.
+            result = PollResult.UNCHANGED
+
+        if task.cancelled or result is PollResult.DONE:
+            return
+        task.interval = self.get_next_interval(result, task.interval)
+        self._schedule(task, task.interval)
+
+    def get_next_interval(self, result, interval):
+        """Return the interval until the next poll of a source after the ``result``.
+
+        :param interval: the previous interval, None before the first poll.
+        """
+        if result is PollResult.WAITING:
+            return self.waiting_interval
+        elif result is PollResult.CHANGED or interval is None:
+            return self.min_interval
+        return min(2 * interval, self.max_interval)
+
+
+_POLL_SCHEDULER = None
+_POLL_SCHEDULER_LOCK = Lock()
+
+
+def get_poll_scheduler():
+    """Return the poll scheduler of this kernel."""
+    global _POLL_SCHEDULER
+
+    with _POLL_SCHEDULER_LOCK:
+        if _POLL_SCHEDULER is None:
+            _POLL_SCHEDULER = PollScheduler()
+        return _POLL_SCHEDULER
@@ -1,22 +1,38 @@
 """Widgets related to process management."""
+import html
 from dataclasses import dataclass
-from threading import Event, Lock, Thread
+from datetime import datetime, time, timedelta
+from threading import Lock, Timer
+from time import monotonic
 
 import ipywidgets as ipw
 import traitlets
-from aiida.orm import load_node
-from aiida.tools.query.calculation import CalculationQueryBuilder
+from aiida.common import timezone
+from aiida.orm import QueryBuilder, WorkflowNode
+from aiida.tools.query.formatting import format_state
 
+from aiidalab_qe.events import get_process_event_hub
+from aiidalab_qe.summary import (
+    SUMMARY_EXTRA,
+    is_unknown_summary,
+    is_valid_summary,
+    normalize_formula,
+    query_summaries,
+)
 
-class WorkChainSelector(ipw.HBox):
+
+class WorkChainSelector(ipw.VBox):
 
     # The PK of a 'aiida.workflows:quantumespresso.pw.bands' WorkChainNode.
     value = traitlets.Int(allow_none=True)
 
     # When this trait is set to a positive value, the work chains are automatically
-    # refreshed every `auto_refresh_interval` seconds.
+    # refreshed on process state changes, at most every `auto_refresh_interval` seconds.
     auto_refresh_interval = traitlets.Int()  # seconds
 
+    # The maximal number of work chains shown at once.
+    page_size = traitlets.Int()
+
     # Indicate whether the widget is currently updating the work chain options.
     busy = traitlets.Bool(read_only=True)
 
@@ -25,7 +41,28 @@ class WorkChainSelector(ipw.HBox):
     # use `None` as setting the widget's value to None will lead to "no selection".
     _NO_PROCESS = object()
 
-    FMT_WORKCHAIN = "{wc.pk:6}{wc.ctime:>10}\t{wc.state:<16}\t{wc.formula} \t {wc.relax_info} \t {wc.properties_info}"
+    # The PKs of the work chains whose summary cannot be generated, so that their
+    # inputs are not queried again. The inputs of stored nodes do not change.
+    _unknown_summaries = set()
+
+    FMT_WORKCHAIN = "{wc.pk:6}{wc.ctime:>18}\t{wc.state:<16}\t{wc.formula} \t {wc.relax_info} \t {wc.properties_info}"
+
+    _STATE_FILTERS = {
+        None: {},
+        "active": {
+            "attributes.process_state": {"in": ["created", "waiting", "running"]}
+        },
+        "finished_ok": {
+            "attributes.process_state": "finished",
+            "attributes.exit_status": 0,
+        },
+        "failed": {
+            "attributes.process_state": "finished",
+            "attributes.exit_status": {">": 0},
+        },
+        "excepted": {"attributes.process_state": "excepted"},
+        "killed": {"attributes.process_state": "killed"},
+    }
 
     def __init__(self, **kwargs):
         self.work_chains_prompt = ipw.HTML(
@@ -44,16 +81,115 @@ class WorkChainSelector(ipw.HBox):
         self.refresh_work_chains_button = ipw.Button(description="Refresh")
         self.refresh_work_chains_button.on_click(self.refresh_work_chains)
 
+        self.previous_page_button = ipw.Button(
+            icon="chevron-left", tooltip="Previous page", layout={"width": "40px"}
+        )
+        self.previous_page_button.on_click(lambda _: self._on_page_change(-1))
+        self.next_page_button = ipw.Button(
+            icon="chevron-right", tooltip="Next page", layout={"width": "40px"}
+        )
+        self.next_page_button.on_click(lambda _: self._on_page_change(1))
+        self.page_info = ipw.HTML()
+
+        # Search filters, all of them are applied in the database query.
+        filter_layout = {"width": "auto"}
+        filter_style = {"description_width": "initial"}
+        self.formula_filter = ipw.Text(
+            description="Formula:",
+            placeholder="e.g. SiO2",
+            continuous_update=False,
+            layout=filter_layout,
+            style=filter_style,
+        )
+        self.formula_filter_message = ipw.HTML()
+        self.state_filter = ipw.Dropdown(
+            description="State:",
+            options=[
+                ("All", None),
+                ("Active", "active"),
+                ("Finished", "finished_ok"),
+                ("Failed", "failed"),
+                ("Excepted", "excepted"),
+                ("Killed", "killed"),
+            ],
+            layout=filter_layout,
+            style=filter_style,
+        )
+        self.date_from_filter = ipw.DatePicker(
+            description="Created from:", layout=filter_layout, style=filter_style
+        )
+        self.date_to_filter = ipw.DatePicker(
+            description="to:", layout=filter_layout, style=filter_style
+        )
+        self.relax_type_filter = ipw.Dropdown(
+            description="Relaxation:",
+            options=[
+                ("All", None),
+                ("Structure as is", "none"),
+                ("Atomic positions", "positions"),
+                ("Full geometry", "positions_cell"),
+            ],
+            layout=filter_layout,
+            style=filter_style,
+        )
+        self.properties_filter = ipw.SelectMultiple(
+            description="Properties:",
+            options=[("Band structure", "bands"), ("Projected DOS", "pdos")],
+            rows=2,
+            layout=filter_layout,
+            style=filter_style,
+        )
+        filters = [
+            self.formula_filter,
+            self.state_filter,
+            self.date_from_filter,
+            self.date_to_filter,
+            self.relax_type_filter,
+            self.properties_filter,
+        ]
+        for widget in filters:
+            widget.observe(self._on_filters_change, "value")
+
+        # All widgets that are disabled while the widget is busy.
+        self._controls = [
+            self.work_chains_selector,
+            self.refresh_work_chains_button,
+            self.previous_page_button,
+            self.next_page_button,
+            *filters,
+        ]
+
+        # The rendered rows of the work chains on the current page (pk -> label),
+        # ordered by creation time, the latest modification time of any work
+        # chain and the selected work chain, in case that it is not on the
+        # current page.
+        self._work_chains = {}
+        self._last_modified = None
+        self._selected = None
+        self._page = 0
+        self._num_work_chains = 0
+
         self._refresh_lock = Lock()
-        self._refresh_thread = None
-        self._stop_refresh_thread = Event()
-        self._update_auto_refresh_thread_state()
+        self._last_auto_refresh = None
+        self._auto_refresh_timer = None
+        self._update_auto_refresh_state()
 
         super().__init__(
             children=[
-                self.work_chains_prompt,
-                self.work_chains_selector,
-                self.refresh_work_chains_button,
+                ipw.HBox(
+                    children=[
+                        self.work_chains_prompt,
+                        self.work_chains_selector,
+                        self.previous_page_button,
+                        self.page_info,
+                        self.next_page_button,
+                        self.refresh_work_chains_button,
+                    ]
+                ),
+                ipw.HBox(
+                    children=[*filters, self.formula_filter_message],
+                    layout={"flex_flow": "row wrap"},
+                ),
             ],
             **kwargs,
         )
@@ -66,53 +202,162 @@ class WorkChainSelector(ipw.HBox):
         formula: str
         relax_info: str
         properties_info: str
+        mtime: datetime
+
+    @staticmethod
+    def _build_work_chains_query(filters=None, project="id"):
+        """Return the query for the QeAppWorkChain nodes matching the filters.
+
+        :param filters: ``QueryBuilder`` filters applied to the work chain nodes.
+        :param project: the projections on the work chain nodes.
+        """
+        qb = QueryBuilder()
+        qb.append(
+            WorkflowNode,
+            filters={"attributes.process_label": "QeAppWorkChain", **(filters or {})},
+            project=project,
+            tag="process",
+        )
+        return qb
 
     @classmethod
-    def find_work_chains(cls):
-        builder = CalculationQueryBuilder()
-        filters = builder.get_filters(
-            process_label="QeAppWorkChain",
-        )
-        query_set = builder.get_query_set(
+    def _build_query(cls, filters=None):
+        """Return the query for the QeAppWorkChain nodes and their summaries."""
+        qb = cls._build_work_chains_query(
             filters=filters,
-            order_by={"ctime": "desc"},
-        )
-        projected = builder.get_projected(
-            query_set, projections=["pk", "ctime", "state"]
-        )
-
-        for process in projected[1:]:
-            workchain = load_node(process[0])
-            formula = workchain.inputs.structure.get_formula()
-
-            properties = []
-            if "pdos" in workchain.inputs:
-                properties.append("pdos")
-            if "bands" in workchain.inputs:
-                properties.append("bands")
-
-            if "relax" in workchain.inputs:
-                builder_parameters = workchain.get_extra("builder_parameters", {})
-                relax_type = builder_parameters.get("relax_type")
-
-                if relax_type != "none":
-                    relax_info = "structure is relaxed"
-                else:
-                    relax_info = "static SCF calculation on structure"
-            else:
-                relax_info = "structure is not relaxed"
-
-            if not properties:
-                properties_info = ""
-            else:
-                properties_info = f"properties on {', '.join(properties)}"
-
-            yield cls.WorkChainData(
-                formula=formula,
-                relax_info=relax_info,
-                properties_info=properties_info,
-                *process,
+            project=[
+                "id",
+                "ctime",
+                "mtime",
+                "attributes.process_state",
+                "attributes.paused",
+                "attributes.exit_status",
+                f"extras.{SUMMARY_EXTRA}",
+            ],
+        )
+        qb.order_by({"process": [{"ctime": "desc"}, {"id": "desc"}]})
+        return qb
+
+    @classmethod
+    def _make_work_chain_data(cls, process, summary):
+        """Create the ``WorkChainData`` from the projected query results.
+
+        :param process: the projected attributes of the work chain node.
+        :param summary: the summary of the work chain, None if it is unknown.
+        """
+        if summary is None:
+            # The summary could not be generated, e.g., the inputs are missing.
+            summary = {"formula": "unknown", "relax": None, "properties": []}
+        properties = summary["properties"]
+
+        # The relax sub-workflow runs (at least) a SCF calculation, unless there
+        # is nothing to relax, then it is skipped if other properties are computed.
+        if summary["relax"] is None:
+            relax_info = ""
+        elif not summary["relax"]:
+            relax_info = "structure is not relaxed"
+        elif summary["relax_type"] != "none":
+            relax_info = "structure is relaxed"
+        else:
+            relax_info = "static SCF calculation on structure"
+
+        if not properties:
+            properties_info = ""
+        else:
+            properties_info = f"properties on {', '.join(properties)}"
+
+        return cls.WorkChainData(
+            pk=process["id"],
+            ctime=timezone.localtime(process["ctime"]).strftime("%Y-%m-%d %H:%M"),
+            state=format_state(
+                process["attributes.process_state"],
+                process["attributes.paused"],
+                process["attributes.exit_status"],
+            ),
+            formula=summary["formula"],
+            relax_info=relax_info,
+            properties_info=properties_info,
+            mtime=process["mtime"],
+        )
+
+    @classmethod
+    def find_work_chains(cls, filters=None):
+        """Yield the ``WorkChainData`` of all QeAppWorkChain nodes matching ``filters``.
+
+        The summaries are read from the extras of the work chains. Only for work
+        chains without (up to date) summary, e.g., those submitted with an older
+        version of the app, they are generated from the inputs. Work chains
+        without the inputs to generate the summary are listed with an unknown
+        summary.
+
+        :param filters: ``QueryBuilder`` filters applied to the work chain nodes.
+        """
+        processes = [row["process"] for row in cls._build_query(filters).iterdict()]
+        missing = [
+            process["id"]
+            for process in processes
+            if not is_valid_summary(process[f"extras.{SUMMARY_EXTRA}"])
+            and not is_unknown_summary(process[f"extras.{SUMMARY_EXTRA}"])
+            and process["id"] not in cls._unknown_summaries
+        ]
+        summaries = {}
+        if missing:
+            for process, summary in query_summaries(filters={"id": {"in": missing}}):
+                summaries[process["id"]] = summary
+            cls._unknown_summaries.update(set(missing) - set(summaries))
+
+        for process in processes:
+            summary = process[f"extras.{SUMMARY_EXTRA}"]
+            if not is_valid_summary(summary):
+                summary = summaries.get(process["id"])
+            yield cls._make_work_chain_data(process, summary)
+
+    def _get_filters(self):
+        """Return the process filters set in the search widgets.
+
+        The formula, relaxation and properties are matched on the summary extra,
+        so work chains without summary only match once their summaries are
+        stored, see ``python -m aiidalab_qe backfill-summaries``.
+        """
+        filters = {}
+
+        self.formula_filter_message.value = ""
+        if self.formula_filter.value.strip():
+            try:
+                filters[f"extras.{SUMMARY_EXTRA}.formula"] = normalize_formula(
+                    self.formula_filter.value
+                )
+            except ValueError as error:
+                self.formula_filter_message.value = (
+                    f'<span style="color: red">{html.escape(str(error))}</span>'
+                )
+                filters["id"] = {"<": 0}  # no work chain matches an invalid formula
+
+        filters.update(self._STATE_FILTERS[self.state_filter.value])
+
+        ctime_filters = {}
+        if self.date_from_filter.value is not None:
+            ctime_filters[">="] = timezone.make_aware(
+                datetime.combine(self.date_from_filter.value, time.min)
             )
+        if self.date_to_filter.value is not None:
+            ctime_filters["<"] = timezone.make_aware(
+                datetime.combine(
+                    self.date_to_filter.value + timedelta(days=1), time.min
+                )
+            )
+        if ctime_filters:
+            filters["ctime"] = ctime_filters
+
+        if self.relax_type_filter.value is not None:
+            filters[f"extras.{SUMMARY_EXTRA}.relax_type"] = self.relax_type_filter.value
+
+        if self.properties_filter.value:
+            filters[f"extras.{SUMMARY_EXTRA}.properties"] = {
+                "contains": list(self.properties_filter.value)
+            }
+
+        return filters
 
     @traitlets.default("busy")
     def _default_busy(self):
@@ -120,57 +365,159 @@ class WorkChainSelector(ipw.HBox):
 
     @traitlets.observe("busy")
     def _observe_busy(self, change):
-        for child in self.children:
-            child.disabled = change["new"]
+        for control in self._controls:
+            control.disabled = change["new"]
+        if not change["new"]:
+            self._update_page_controls()
+
+    def _update_page_controls(self):
+        num_pages = max(1, -(-self._num_work_chains // self.page_size))
+        self.page_info.value = (
+            f"Page {self._page + 1} of {num_pages} ({self._num_work_chains} workflows)"
+        )
+        self.previous_page_button.disabled = self.busy or self._page == 0
+        self.next_page_button.disabled = self.busy or self._page + 1 >= num_pages
 
     def refresh_work_chains(self, _=None):
+        """Re-query the work chains on the current page and rebuild the options."""
         with self._refresh_lock:
             try:
                 self.set_trait("busy", True)  # disables the widget
 
-                with self.hold_trait_notifications():
-                    # We need to restore the original value, because it may be reset due to this issue:
-                    # https://github.com/jupyter-widgets/ipywidgets/issues/2230
-                    original_value = self.work_chains_selector.value
-
-                    self.work_chains_selector.options = [
-                        ("New workflow...", self._NO_PROCESS)
-                    ] + [
-                        (self.FMT_WORKCHAIN.format(wc=wc), wc.pk)
-                        for wc in self.find_work_chains()
-                    ]
-
-                    self.work_chains_selector.value = original_value
+                self._work_chains = {}
+                self._last_modified = None
+                self._fetch_work_chains()
             finally:
                 self.set_trait("busy", False)  # reenable the widget
 
-    def _auto_refresh_loop(self):
-        while True:
+    def update_work_chains(self):
+        """Fetch only work chains that were created or modified since the last refresh.
+
+        The options are only re-sent to the front end in case that any of the
+        rendered rows changed. Work chains that were deleted are only removed by
+        a full refresh.
+        """
+        if self._last_modified is None:
             self.refresh_work_chains()
-            if self._stop_refresh_thread.wait(timeout=self.auto_refresh_interval):
-                break
-
-    def _update_auto_refresh_thread_state(self):
-        if self.auto_refresh_interval > 0 and self._refresh_thread is None:
-            # start thread
-            self._stop_refresh_thread.clear()
-            self._refresh_thread = Thread(target=self._auto_refresh_loop)
-            self._refresh_thread.start()
-
-        elif self.auto_refresh_interval <= 0 and self._refresh_thread is not None:
-            # stop thread
-            self._stop_refresh_thread.set()
-            self._refresh_thread.join(timeout=30)
-            self._refresh_thread = None
+        else:
+            with self._refresh_lock:
+                self._fetch_work_chains()
+
+    def _fetch_work_chains(self):
+        filters = self._get_filters()
+
+        # The modifications are probed without the filters, since a work chain
+        # that is modified may no longer match them, e.g., once it is finished,
+        # and must then be removed from the current page.
+        if self._last_modified is None:
+            modified = {}
+            qb = self._build_work_chains_query(project="mtime")
+            qb.order_by({"process": {"mtime": "desc"}}).limit(1)
+            self._last_modified = qb.first(flat=True)
+        else:
+            qb = self._build_work_chains_query(
+                {"mtime": {">": self._last_modified}}, project=["id", "mtime"]
+            )
+            modified = dict(qb.all())
+            if not modified:
+                return  # nothing changed since the last refresh
+            self._last_modified = max(modified.values())
+
+        # Only the work chains on the current page are loaded.
+        qb = self._build_work_chains_query(filters)
+        self._num_work_chains = qb.count()
+        self._page = min(self._page, (self._num_work_chains - 1) // self.page_size)
+        self._page = max(self._page, 0)
+        qb.order_by({"process": [{"ctime": "desc"}, {"id": "desc"}]})
+        qb.offset(self._page * self.page_size).limit(self.page_size)
+        page = qb.all(flat=True)
+
+        outdated = [pk for pk in page if pk not in self._work_chains or pk in modified]
+        if outdated:
+            for wc in self.find_work_chains(filters={"id": {"in": outdated}}):
+                self._work_chains[wc.pk] = self.FMT_WORKCHAIN.format(wc=wc)
+
+        self._work_chains = {pk: self._work_chains[pk] for pk in page}
+        self._update_options()
+        self._update_page_controls()
+
+    def _update_options(self):
+        rows = dict(self._work_chains)
+        # Keep the selected work chain in the options even if it is not on the
+        # current page, since otherwise the selection would be reset.
+        if self._selected is not None and self._selected[0] not in rows:
+            rows = {self._selected[0]: self._selected[1], **rows}
+
+        options = (("New workflow...", self._NO_PROCESS),) + tuple(
+            (label, pk) for pk, label in rows.items()
+        )
+        if options == tuple(self.work_chains_selector.options):
+            return
+
+        with self.hold_trait_notifications():
+            # We need to restore the original value, because it may be reset due to this issue:
+            # https://github.com/jupyter-widgets/ipywidgets/issues/2230
+            original_value = self.work_chains_selector.value
+            self.work_chains_selector.options = options
+            self.work_chains_selector.value = original_value
+
+    def _on_filters_change(self, _=None):
+        self._page = 0
+        self.refresh_work_chains()
+
+    def _on_page_change(self, step):
+        self._page = max(0, self._page + step)
+        self.refresh_work_chains()
+
+    def _on_process_state_change(self, _=None):
+        """Refresh the work chains, unless they were refreshed very recently."""
+        if self._auto_refresh_timer is not None:
+            return  # a refresh is already scheduled
+
+        delay = 0
+        if self._last_auto_refresh is not None:
+            elapsed = monotonic() - self._last_auto_refresh
+            delay = max(0, self.auto_refresh_interval - elapsed)
+
+        if delay > 0:
+            self._auto_refresh_timer = Timer(delay, self._auto_refresh)
+            self._auto_refresh_timer.start()
+        else:
+            self._auto_refresh()
+
+    def _auto_refresh(self):
+        self._auto_refresh_timer = None
+        self._last_auto_refresh = monotonic()
+        self.update_work_chains()
+
+    def _update_auto_refresh_state(self):
+        hub = get_process_event_hub()
+        if self.auto_refresh_interval > 0:
+            hub.subscribe(self._on_process_state_change)
+            self._auto_refresh()
+        else:
+            hub.unsubscribe(self._on_process_state_change)
+            if self._auto_refresh_timer is not None:
+                self._auto_refresh_timer.cancel()
+                self._auto_refresh_timer = None
 
     @traitlets.default("auto_refresh_interval")
     def _default_auto_refresh_interval(self):
         return 10  # seconds
 
+    @traitlets.default("page_size")
+    def _default_page_size(self):
+        return 50
+
     @traitlets.observe("auto_refresh_interval")
     def _observe_auto_refresh_interval(self, change):
         if change["new"] != change["old"]:
-            self._update_auto_refresh_thread_state()
+            self._update_auto_refresh_state()
+
+    @traitlets.observe("page_size")
+    def _observe_page_size(self, change):
+        if change["new"] != change["old"]:
+            self._on_filters_change()
 
     @traitlets.observe("value")
     def _observe_value(self, change):
@@ -179,7 +526,14 @@ class WorkChainSelector(ipw.HBox):
 
         new = self._NO_PROCESS if change["new"] is None else change["new"]
 
-        if new not in {pk for _, pk in self.work_chains_selector.options}:
-            self.refresh_work_chains()
+        if new is self._NO_PROCESS or new in self._work_chains:
+            self._selected = None
+        else:
+            self.update_work_chains()
+            if new not in self._work_chains:
+                # The work chain is not on the current page (or filtered out).
+                for wc in self.find_work_chains(filters={"id": new}):
+                    self._selected = (wc.pk, self.FMT_WORKCHAIN.format(wc=wc))
+                self._update_options()
 
         self.work_chains_selector.value = new
@@ -1,7 +1,56 @@
-from aiida.orm import WorkChainNode
-from aiida.plugins import WorkflowFactory
+import csv
+from itertools import islice
+from pathlib import Path
+
+from aiida.common import LinkType
+from aiida.orm import Data, Group, QueryBuilder, WorkChainNode, WorkflowNode
+
+from aiidalab_qe.parameters import get_protocol_inputs
+from aiidalab_qe.summary import (
+    SUMMARY_EXTRA,
+    get_summary,
+    is_unknown_summary,
+    is_valid_summary,
+    query_summaries,
+)
+
+REPORT_EXTRA = "qeapp_report"
+
+# The columns of the bulk reports and the kind of their values: the identification
+# of the work chain followed by the fields of the report dictionary.
+REPORT_COLUMNS = {
+    "pk": "int",
+    "uuid": "str",
+    "ctime": "datetime",
+    "formula": "str",
+    "process_state": "str",
+    "exit_status": "int",
+    "relaxed": "bool",
+    "relax_method": "str",
+    "bands_computed": "bool",
+    "pdos_computed": "bool",
+    "material_magnetic": "str",
+    "electronic_type": "str",
+    "protocol": "str",
+    "pseudo_family": "str",
+    "pseudo_library": "str",
+    "pseudo_version": "str",
+    "functional": "str",
+    "pseudo_protocol": "str",
+    "energy_cutoff_wfc": "int",
+    "energy_cutoff_rho": "int",
+    "degauss": "float",
+    "smearing": "str",
+    "scf_kpoints_distance": "float",
+    "bands_kpoints_distance": "float",
+    "nscf_kpoints_distance": "float",
+    # The error, if the report could not be generated completely.
+    "error": "str",
+}
 
-PwBaseWorkChain = WorkflowFactory("quantumespresso.pw.base")
+# Increment the version whenever the content of the report changes, outdated
+# reports cached in the extras of the work chains are then regenerated.
+REPORT_VERSION = 1
 
 
 FUNCTIONAL_LINK_MAP = {
@@ -26,16 +75,56 @@ FUNCTIONAL_REPORT_MAP = {
 }
 
 
-def _generate_report_dict(qeapp_wc: WorkChainNode):
-    builder_parameters = qeapp_wc.base.extras.get("builder_parameters", {})
+# The input links of the QeAppWorkChain that are reported, mapped to the attribute
+# of the input node that is reported: the value of the ``Float`` and ``Str``
+# nodes and the "SYSTEM" namelist of the ``Dict`` nodes of the pw.x parameters.
+_REPORT_INPUT_LINKS = {
+    "kpoints_distance_override": "value",
+    "degauss_override": "value",
+    "smearing_override": "value",
+    "relax__base__pw__parameters": "SYSTEM",
+    "relax__base__kpoints_distance": "value",
+    "bands__scf__pw__parameters": "SYSTEM",
+    "bands__scf__kpoints_distance": "value",
+    "bands__bands_kpoints_distance": "value",
+    "pdos__scf__pw__parameters": "SYSTEM",
+    "pdos__scf__kpoints_distance": "value",
+    "pdos__nscf__kpoints_distance": "value",
+}
+
+
+def _get_report_inputs(qeapp_wc: WorkChainNode):
+    """Return the reported attributes of the inputs of the work chain by link label."""
+    inputs = {}
+    for link in qeapp_wc.base.links.get_incoming(link_type=LinkType.INPUT_WORK).all():
+        if link.link_label in _REPORT_INPUT_LINKS:
+            attribute = _REPORT_INPUT_LINKS[link.link_label]
+            inputs[link.link_label] = link.node.base.attributes.get(attribute, None)
+    return inputs
 
-    # Properties
-    run_relax = builder_parameters.get("relax_type") != "none"
-    run_bands = builder_parameters.get("run_bands")
-    run_pdos = builder_parameters.get("run_pdos")
 
-    yield "relaxed", run_relax
-    yield "relax_method", builder_parameters["relax_type"]
+def _generate_report_items(builder_parameters, summary, inputs):
+    """Generate the report items of a QeAppWorkChain.
+
+    :param builder_parameters: the builder parameters of the work chain.
+    :param summary: the summary of the work chain or None if not available.
+    :param inputs: the reported attributes of the inputs of the work chain by
+        link label, see ``_REPORT_INPUT_LINKS``.
+    """
+    # Properties
+    if summary is not None:
+        relax_type = summary["relax_type"]
+        run_bands = "bands" in summary["properties"]
+        run_pdos = "pdos" in summary["properties"]
+        protocol = summary["protocol"]
+    else:
+        relax_type = builder_parameters["relax_type"]
+        run_bands = builder_parameters.get("run_bands")
+        run_pdos = builder_parameters.get("run_pdos")
+        protocol = builder_parameters["protocol"]
+
+    yield "relaxed", relax_type != "none"
+    yield "relax_method", relax_type
     yield "bands_computed", run_bands
     yield "pdos_computed", run_pdos
 
@@ -44,13 +133,12 @@ def _generate_report_dict(qeapp_wc: WorkChainNode):
     yield "electronic_type", builder_parameters["electronic_type"]
 
     # Calculation settings
-    yield "protocol", builder_parameters["protocol"]
+    yield "protocol", protocol
 
     try:
         pseudo_family = builder_parameters.get("pseudo_family", None)
         if pseudo_family is None:
-            protocol = builder_parameters.get("pseudo_family", "moderate")
-            pseudo_family = PROTOCOL_PSEUDO_MAP[protocol]
+            pseudo_family = PROTOCOL_PSEUDO_MAP[protocol or "moderate"]
 
         yield "pseudo_family", pseudo_family
 
@@ -78,24 +166,18 @@ def _generate_report_dict(qeapp_wc: WorkChainNode):
     scf_kpoints_distance = None
     bands_kpoints_distance = None
 
-    try:
-        scf_kpoints_distance = qeapp_wc.inputs.kpoints_distance_override.value
-    except AttributeError:
-        scf_kpoints_distance = None
+    scf_kpoints_distance = inputs.get("kpoints_distance_override")
     nscf_kpoints_distance = None
 
-    default_params = PwBaseWorkChain.get_protocol_inputs(
-        builder_parameters["protocol"]
-    )["pw"]["parameters"]["SYSTEM"]
-    try:
-        degauss = qeapp_wc.inputs.degauss_override.value
-    except AttributeError:
+    default_params = get_protocol_inputs(protocol)["pw"]
+    default_params = default_params["parameters"]["SYSTEM"]
+    degauss = inputs.get("degauss_override")
+    if degauss is None:
         # read default from protocol
         degauss = default_params["degauss"]
 
-    try:
-        smearing = qeapp_wc.inputs.smearing_override.value
-    except AttributeError:
+    smearing = inputs.get("smearing_override")
+    if smearing is None:
         # read default from protocol
         smearing = default_params["smearing"]
 
@@ -103,27 +185,25 @@ def _generate_report_dict(qeapp_wc: WorkChainNode):
     # the "relax" port is poped out to skip the real relaxiation
     # which is not the case of SCF, we use the relax workchain but with
     # relax_type set to none as SCF calculation.
-    if "relax" in qeapp_wc.inputs:
-        pw_parameters = qeapp_wc.inputs.relax.base.pw.parameters.get_dict()
+    if "relax__base__pw__parameters" in inputs:
+        pw_parameters = inputs["relax__base__pw__parameters"]
         if scf_kpoints_distance is None:
-            scf_kpoints_distance = qeapp_wc.inputs.relax.base.kpoints_distance.value
+            scf_kpoints_distance = inputs["relax__base__kpoints_distance"]
 
     if run_bands:
-        pw_parameters = qeapp_wc.inputs.bands.scf.pw.parameters.get_dict()
+        pw_parameters = inputs["bands__scf__pw__parameters"]
         if scf_kpoints_distance is None:
-            scf_kpoints_distance = qeapp_wc.inputs.bands.scf.kpoints_distance.value
-        bands_kpoints_distance = qeapp_wc.inputs.bands.bands_kpoints_distance.value
+            scf_kpoints_distance = inputs["bands__scf__kpoints_distance"]
+        bands_kpoints_distance = inputs["bands__bands_kpoints_distance"]
     if run_pdos:
         scf_kpoints_distance = (
-            scf_kpoints_distance or qeapp_wc.inputs.pdos.scf.kpoints_distance.value
-        )
-        pw_parameters = (
-            pw_parameters or qeapp_wc.inputs.pdos.scf.pw.parameters.get_dict()
+            scf_kpoints_distance or inputs["pdos__scf__kpoints_distance"]
         )
-        nscf_kpoints_distance = qeapp_wc.inputs.pdos.nscf.kpoints_distance.value
+        pw_parameters = pw_parameters or inputs["pdos__scf__pw__parameters"]
+        nscf_kpoints_distance = inputs["pdos__nscf__kpoints_distance"]
 
-    energy_cutoff_wfc = round(pw_parameters["SYSTEM"]["ecutwfc"])
-    energy_cutoff_rho = round(pw_parameters["SYSTEM"]["ecutrho"])
+    energy_cutoff_wfc = round(pw_parameters["ecutwfc"])
+    energy_cutoff_rho = round(pw_parameters["ecutrho"])
 
     yield "energy_cutoff_wfc", energy_cutoff_wfc
     yield "energy_cutoff_rho", energy_cutoff_rho
@@ -134,9 +214,231 @@ def _generate_report_dict(qeapp_wc: WorkChainNode):
     yield "nscf_kpoints_distance", nscf_kpoints_distance
 
 
+def _generate_report_dict(qeapp_wc: WorkChainNode):
+    yield from _generate_report_items(
+        builder_parameters=qeapp_wc.base.extras.get("builder_parameters", {}),
+        summary=get_summary(qeapp_wc),
+        inputs=_get_report_inputs(qeapp_wc),
+    )
+
+
+def _get_cached_report(extra):
+    """Return the report of the (projected) report extra, if present and up to date."""
+    if extra is not None and extra.get("version") == REPORT_VERSION:
+        return extra["report"]
+    return None
+
+
 def generate_report_dict(qeapp_wc):
-    """Generate a dictionary for reporting the inputs for the `QeAppWorkChain`"""
-    return dict(_generate_report_dict(qeapp_wc))
+    """Generate a dictionary for reporting the inputs for the `QeAppWorkChain`
+
+    The report of terminated work chains does not change anymore, so it is
+    cached in the extras of the work chain node, unless the storage is read-only.
+
+    Note that storing the extra updates the modification time of the node, so
+    the first view of a terminated work chain is also detected as a change by
+    the work chain selector and the polling of the process events. This happens
+    once per work chain, and the report is only cached after its process state
+    changed for the last time, which is detected anyway.
+    """
+    cached = _get_cached_report(qeapp_wc.base.extras.get(REPORT_EXTRA, None))
+    if cached is not None:
+        return cached
+
+    report = dict(_generate_report_dict(qeapp_wc))
+    if qeapp_wc.is_terminated:
+        try:
+            qeapp_wc.base.extras.set(
+                REPORT_EXTRA, {"version": REPORT_VERSION, "report": report}
+            )
+        except Exception:
+            pass  # e.g., read-only storage, the report is generated on every view
+    return report
+
+
+def _query_report_rows(pks):
+    """Generate the report rows of the QeAppWorkChain nodes with the given ``pks``."""
+    qb = QueryBuilder()
+    qb.append(
+        WorkflowNode,
+        filters={"id": {"in": pks}},
+        project=[
+            "id",
+            "uuid",
+            "ctime",
+            "attributes.process_state",
+            "attributes.exit_status",
+            "extras.builder_parameters",
+            f"extras.{SUMMARY_EXTRA}",
+            f"extras.{REPORT_EXTRA}",
+        ],
+        tag="process",
+    )
+    processes = {row["process"]["id"]: row["process"] for row in qb.iterdict()}
+
+    # The reported attributes of the inputs of all work chains that have no
+    # cached report are retrieved with a single query.
+    uncached = [
+        pk
+        for pk, process in processes.items()
+        if _get_cached_report(process[f"extras.{REPORT_EXTRA}"]) is None
+    ]
+    inputs = {pk: {} for pk in uncached}
+    if uncached:
+        qb = QueryBuilder()
+        qb.append(
+            WorkflowNode, filters={"id": {"in": uncached}}, project="id", tag="process"
+        )
+        qb.append(
+            Data,
+            with_outgoing="process",
+            edge_filters={
+                "type": LinkType.INPUT_WORK.value,
+                "label": {"in": list(_REPORT_INPUT_LINKS)},
+            },
+            edge_project="label",
+            edge_tag="link",
+            project=[
+                f"attributes.{name}" for name in set(_REPORT_INPUT_LINKS.values())
+            ],
+            tag="input",
+        )
+        for row in qb.iterdict():
+            label = row["link"]["label"]
+            inputs[row["process"]["id"]][label] = row["input"][
+                f"attributes.{_REPORT_INPUT_LINKS[label]}"
+            ]
+
+    # The summaries that are missing or outdated are generated with a single query.
+    summaries = {
+        pk: process[f"extras.{SUMMARY_EXTRA}"]
+        for pk, process in processes.items()
+        if is_valid_summary(process[f"extras.{SUMMARY_EXTRA}"])
+    }
+    missing = [
+        pk
+        for pk, process in processes.items()
+        if pk not in summaries
+        and not is_unknown_summary(process[f"extras.{SUMMARY_EXTRA}"])
+    ]
+    if missing:
+        for process, summary in query_summaries(filters={"id": {"in": missing}}):
+            summaries[process["id"]] = summary
+
+    for pk, process in processes.items():
+        summary = summaries.get(pk)
+        row = dict.fromkeys(REPORT_COLUMNS)
+        row.update(
+            pk=pk,
+            uuid=process["uuid"],
+            ctime=process["ctime"],
+            formula=summary["formula"] if summary is not None else None,
+            process_state=process["attributes.process_state"],
+            exit_status=process["attributes.exit_status"],
+        )
+
+        report = _get_cached_report(process[f"extras.{REPORT_EXTRA}"])
+        if report is None:
+            # Keep the fields generated until the report of the work chain fails,
+            # e.g., because it was not submitted from the app.
+            report = {}
+            try:
+                for key, value in _generate_report_items(
+                    builder_parameters=process["extras.builder_parameters"] or {},
+                    summary=summary,
+                    inputs=inputs[pk],
+                ):
+                    report[key] = value
+            except Exception as error:
+                row["error"] = f"{type(error).__name__}: {error}"
+
+        row.update((key, report[key]) for key in REPORT_COLUMNS if key in report)
+        yield row
+
+
+def query_reports(filters=None, group=None, batch_size=1000):
+    """Generate the report rows of the QeAppWorkChain nodes matching ``filters``.
+
+    The work chains are processed in batches of ``batch_size`` nodes, the data of
+    each batch is retrieved with a few queries, without loading the nodes.
+
+    :param filters: ``QueryBuilder`` filters applied to the work chain nodes.
+    :param group: only report the work chains in the group with this label.
+    :return: generator of dictionaries with the ``REPORT_COLUMNS`` as keys.
+    """
+    qb = QueryBuilder()
+    joins = {}
+    if group is not None:
+        qb.append(Group, filters={"label": group}, tag="group")
+        joins["with_group"] = "group"
+    qb.append(
+        WorkflowNode,
+        filters={"attributes.process_label": "QeAppWorkChain", **(filters or {})},
+        project="id",
+        **joins,
+    )
+    pks = sorted(set(qb.all(flat=True)))
+
+    for start in range(0, len(pks), batch_size):
+        yield from _query_report_rows(pks[start : start + batch_size])
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def write_reports(rows, path, file_format=None, batch_size=1000):
+    """Write the report ``rows`` to a CSV or Parquet file.
+
+    The rows are streamed to the file, in batches of ``batch_size`` rows for
+    Parquet files, so the reports of all work chains are never held in memory.
+
+    :param rows: iterable of the report rows, e.g., from ``query_reports``.
+    :param file_format: "csv" or "parquet", by default from the file extension.
+    :return: the number of rows written.
+    """
+    path = Path(path)
+    file_format = file_format or path.suffix.lstrip(".").lower()
+    num_rows = 0
+
+    if file_format == "csv":
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(REPORT_COLUMNS))
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                num_rows += 1
+
+    elif file_format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise ImportError(
+                "Writing Parquet files requires the 'pyarrow' package."
+            ) from error
+
+        types = {
+            "int": pa.int64(),
+            "float": pa.float64(),
+            "bool": pa.bool_(),
+            "str": pa.string(),
+            "datetime": pa.timestamp("us", tz="UTC"),
+        }
+        schema = pa.schema(
+            [(column, types[kind]) for column, kind in REPORT_COLUMNS.items()]
+        )
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in _batched(rows, batch_size):
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                num_rows += len(batch)
+
+    else:
+        raise ValueError(f"Unknown report file format '{file_format}'.")
+
+    return num_rows
 
 
 def generate_report_text(report_dict):
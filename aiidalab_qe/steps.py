@@ -14,19 +14,20 @@ from aiida.engine import ProcessBuilderNamespace, ProcessState, submit
 from aiida.orm import WorkChainNode, load_code, load_node
 from aiida.plugins import DataFactory
 from aiida_quantumespresso.common.types import ElectronicType, RelaxType, SpinType
-from aiida_quantumespresso.workflows.pw.base import PwBaseWorkChain
 from aiidalab_widgets_base import (
     ComputationalResourcesWidget,
-    ProcessMonitor,
     ProcessNodesTreeWidget,
     WizardAppWidgetStep,
 )
 from IPython.display import display
 
-from aiidalab_qe.parameters import DEFAULT_PARAMETERS
+from aiidalab_qe.archive import get_archive_job_service
+from aiidalab_qe.events import get_process_event_hub
+from aiidalab_qe.parameters import DEFAULT_PARAMETERS, get_protocol_inputs
 from aiidalab_qe.pseudos import PseudoFamilySelector
 from aiidalab_qe.setup_codes import QESetupWidget
 from aiidalab_qe.sssp import SSSPInstallWidget
+from aiidalab_qe.summary import SUMMARY_EXTRA, generate_summary_from_inputs
 from aiidalab_qe.widgets import (
     NodeViewWidget,
     ParallelizationSettings,
@@ -330,25 +331,23 @@ class ConfigureQeAppWorkChainStep(ipw.VBox, WizardAppWidgetStep):
         ipw.dlink(
             (self.workchain_settings.workchain_protocol, "value"),
             (self.kpoints_settings, "kpoints_distance_default"),
-            lambda protocol: PwBaseWorkChain.get_protocol_inputs(protocol)[
-                "kpoints_distance"
-            ],
+            lambda protocol: get_protocol_inputs(protocol)["kpoints_distance"],
         )
 
         ipw.dlink(
             (self.workchain_settings.workchain_protocol, "value"),
             (self.smearing_settings, "degauss_default"),
-            lambda protocol: PwBaseWorkChain.get_protocol_inputs(protocol)["pw"][
-                "parameters"
-            ]["SYSTEM"]["degauss"],
+            lambda protocol: get_protocol_inputs(protocol)["pw"]["parameters"][
+                "SYSTEM"
+            ]["degauss"],
         )
 
         ipw.dlink(
             (self.workchain_settings.workchain_protocol, "value"),
             (self.smearing_settings, "smearing_default"),
-            lambda protocol: PwBaseWorkChain.get_protocol_inputs(protocol)["pw"][
-                "parameters"
-            ]["SYSTEM"]["smearing"],
+            lambda protocol: get_protocol_inputs(protocol)["pw"]["parameters"][
+                "SYSTEM"
+            ]["smearing"],
         )
 
         self.tab = ipw.Tab(
@@ -894,8 +893,15 @@ class SubmitQeAppWorkChainStep(ipw.VBox, WizardAppWidgetStep):
 
         with self.hold_trait_notifications():
             self.process = submit(builder)
-            # Set the builder parameters on the work chain
-            self.process.base.extras.set("builder_parameters", parameters)
+            # Set the builder parameters and the summary on the work chain
+            self.process.base.extras.set_many(
+                {
+                    "builder_parameters": parameters,
+                    SUMMARY_EXTRA: generate_summary_from_inputs(
+                        self.input_structure, parameters
+                    ),
+                }
+            )
 
     def reset(self):
         with self.hold_trait_notifications():
@@ -907,6 +913,9 @@ class ViewQeAppWorkChainStatusAndResultsStep(ipw.VBox, WizardAppWidgetStep):
 
     process = traitlets.Unicode(allow_none=True)
 
+    # Create the download archive of the work chain when it finishes.
+    prebuild_archive = traitlets.Bool(False)
+
     def __init__(self, **kwargs):
         self.process_tree = ProcessNodesTreeWidget()
         ipw.dlink(
@@ -922,16 +931,6 @@ class ViewQeAppWorkChainStatusAndResultsStep(ipw.VBox, WizardAppWidgetStep):
         )
         self.process_status = ipw.VBox(children=[self.process_tree, self.node_view])
 
-        # Setup process monitor
-        self.process_monitor = ProcessMonitor(
-            timeout=0.2,
-            callbacks=[
-                self.process_tree.update,
-                self._update_state,
-            ],
-        )
-        ipw.dlink((self, "process"), (self.process_monitor, "value"))
-
         super().__init__([self.process_status], **kwargs)
 
     def can_reset(self):
@@ -961,6 +960,24 @@ class ViewQeAppWorkChainStatusAndResultsStep(ipw.VBox, WizardAppWidgetStep):
             elif process.is_finished_ok:
                 self.state = self.State.SUCCESS
 
+    def _on_process_state_change(self, _=None):
+        was_active = self.state is self.State.ACTIVE
+        # Any process may be a descendant of the process shown in the tree.
+        self.process_tree.update()
+        self._update_state()
+        if self.state in (self.State.SUCCESS, self.State.FAIL):
+            get_process_event_hub().unsubscribe(self._on_process_state_change)
+            process = load_node(self.process)
+            if was_active and self.prebuild_archive and process.is_finished:
+                # Create the download archive in the background right away.
+                get_archive_job_service().submit(process)
+
     @traitlets.observe("process")
     def _observe_process(self, change):
-        self._update_state()
+        hub = get_process_event_hub()
+        hub.unsubscribe(self._on_process_state_change)
+        if change["new"] is None:
+            self._update_state()
+        else:
+            hub.subscribe(self._on_process_state_change)
+            self._on_process_state_change()
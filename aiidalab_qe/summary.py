@@ -0,0 +1,276 @@
+"""Summary of QeAppWorkChain nodes stored in their extras.
+
+The summary is written when a work chain is submitted so that listing and
+reporting work chains does not require traversing their input links.
+"""
+import re
+
+from aiida.common import NotExistent
+from aiida.common.constants import elements
+from aiida.manage import get_manager
+from aiida.orm import Node, QueryBuilder, WorkflowNode, load_code
+from aiida.orm.entities import EntityTypes
+from aiida.orm.nodes.data.structure import get_formula, get_symbols_string
+
+__all__ = [
+    "SUMMARY_EXTRA",
+    "SUMMARY_VERSION",
+    "backfill_summaries",
+    "generate_summary",
+    "generate_summary_from_inputs",
+    "get_formula_from_attributes",
+    "get_summary",
+    "is_unknown_summary",
+    "is_valid_summary",
+    "normalize_formula",
+    "query_summaries",
+]
+
+SUMMARY_EXTRA = "qeapp_summary"
+
+# Increment the version whenever the content of the summary changes, outdated
+# summaries are then ignored until they are regenerated.
+SUMMARY_VERSION = 2
+
+# Stored instead of the summary on work chains whose summary cannot be generated,
+# e.g., because they have no input structure, so that they are not queried again.
+UNKNOWN_SUMMARY = {"version": SUMMARY_VERSION, "unknown": True}
+
+CODE_PARAMETERS = ("pw_code", "dos_code", "projwfc_code")
+
+# Labels of the input links of the QeAppWorkChain that are needed to generate the
+# summary. Except for the structure, these are only used to determine which of
+# the (optional) sub-workflow namespaces were populated.
+_SUMMARY_INPUT_LINKS = {
+    "structure": "structure",
+    "relax__base__pw__parameters": "relax",
+    "bands__scf__pw__parameters": "bands",
+    "pdos__nscf__pw__parameters": "pdos",
+}
+
+
+def get_formula_from_attributes(kinds, sites):
+    """Return the chemical formula of a structure from its raw attributes.
+
+    This is equivalent to ``StructureData.get_formula()``, but works on the
+    ``kinds`` and ``sites`` attributes as projected by a ``QueryBuilder``, so the
+    structure node does not need to be loaded.
+    """
+    symbols = {
+        kind["name"]: get_symbols_string(kind["symbols"], kind["weights"])
+        for kind in kinds
+    }
+    return get_formula([symbols[site["kind_name"]] for site in sites])
+
+
+_SYMBOLS = {element["symbol"] for element in elements.values()}
+
+
+def normalize_formula(formula):
+    """Return the chemical ``formula`` in the notation of the summaries, e.g., "O2Si" for "SiO2".
+
+    :raises ValueError: if the formula is not valid, e.g., "si" or "Xy2".
+    """
+    formula = re.sub(r"\s+", "", formula)
+    if not re.fullmatch(r"([A-Z][a-z]?\d*)+", formula):
+        raise ValueError(f"Invalid formula {formula!r}, e.g., SiO2.")
+    symbols = []
+    for symbol, count in re.findall(r"([A-Z][a-z]?)(\d*)", formula):
+        if symbol not in _SYMBOLS:
+            raise ValueError(f"Unknown element {symbol!r} in formula {formula!r}.")
+        symbols.extend([symbol] * int(count or 1))
+    if not symbols:
+        raise ValueError(f"Invalid formula {formula!r}, e.g., SiO2.")
+    return get_formula(symbols)
+
+
+def _get_code_labels(parameters, cache=None):
+    """Return the full labels of the codes referenced in the builder parameters.
+
+    :param cache: optional dictionary to cache the labels across calls.
+    """
+    cache = {} if cache is None else cache
+    labels = {}
+    for key in CODE_PARAMETERS:
+        identifier = parameters.get(key)
+        if identifier is None:
+            continue
+        if identifier not in cache:
+            try:
+                cache[identifier] = load_code(identifier).full_label
+            except NotExistent:
+                cache[identifier] = identifier
+        labels[key] = cache[identifier]
+    return labels
+
+
+def generate_summary(formula, num_sites, parameters, relax, properties, code_labels):
+    """Return the summary of a QeAppWorkChain.
+
+    :param formula: the chemical formula of the input structure.
+    :param num_sites: the number of sites of the input structure.
+    :param parameters: the builder parameters of the work chain.
+    :param relax: whether the relax sub-workflow is run.
+    :param properties: list of the computed properties ("pdos" and/or "bands").
+    :param code_labels: mapping of the code parameters to the full code labels.
+    """
+    return {
+        "version": SUMMARY_VERSION,
+        "formula": formula,
+        "num_sites": num_sites,
+        "relax": relax,
+        "properties": list(properties),
+        "relax_type": parameters.get("relax_type"),
+        "protocol": parameters.get("protocol"),
+        "codes": code_labels,
+    }
+
+
+def generate_summary_from_inputs(structure, parameters):
+    """Return the summary of a QeAppWorkChain submitted with the given inputs.
+
+    :param structure: the input ``StructureData`` node.
+    :param parameters: the builder parameters of the work chain.
+    """
+    properties = [prop for prop in ("pdos", "bands") if parameters.get(f"run_{prop}")]
+    return generate_summary(
+        formula=structure.get_formula(),
+        num_sites=len(structure.sites),
+        parameters=parameters,
+        # The relax sub-workflow is skipped if there is nothing to relax and other
+        # properties are computed, see ``SubmitQeAppWorkChainStep``.
+        relax=parameters.get("relax_type") != "none" or not properties,
+        properties=properties,
+        code_labels=_get_code_labels(parameters),
+    )
+
+
+def is_valid_summary(summary):
+    """Return whether the (projected) summary extra is present and up to date."""
+    return (
+        summary is not None
+        and summary.get("version") == SUMMARY_VERSION
+        and not summary.get("unknown", False)
+    )
+
+
+def is_unknown_summary(summary):
+    """Return whether the (projected) summary extra marks that the summary cannot be generated."""
+    return summary == UNKNOWN_SUMMARY
+
+
+def get_summary(node):
+    """Return the summary of the QeAppWorkChain ``node`` or None if it is missing, outdated or unknown."""
+    summary = node.base.extras.get(SUMMARY_EXTRA, None)
+    return summary if is_valid_summary(summary) else None
+
+
+def query_summaries(filters=None, project=()):
+    """Generate the summaries of the QeAppWorkChain nodes matching ``filters``.
+
+    The summaries are generated from the inputs of the work chains, which are
+    retrieved with a single query for all work chains. Work chains without an
+    input structure are skipped, they have no summary.
+
+    :param filters: ``QueryBuilder`` filters applied to the work chain nodes.
+    :param project: additional projections on the work chain nodes.
+    :return: generator of (projected work chain attributes, summary) tuples.
+    """
+    qb = QueryBuilder()
+    qb.append(
+        WorkflowNode,
+        filters={"attributes.process_label": "QeAppWorkChain", **(filters or {})},
+        project=["id", "extras.builder_parameters", *project],
+        tag="process",
+    )
+    qb.append(
+        Node,
+        with_outgoing="process",
+        edge_filters={"label": {"in": list(_SUMMARY_INPUT_LINKS)}},
+        edge_project="label",
+        edge_tag="link",
+        project=["attributes.kinds", "attributes.sites"],
+        tag="input",
+    )
+
+    processes = {}
+    inputs = {}
+    for row in qb.iterdict():
+        pk = row["process"]["id"]
+        link_label = _SUMMARY_INPUT_LINKS[row["link"]["label"]]
+        processes.setdefault(pk, row["process"])
+        inputs.setdefault(pk, {})[link_label] = row["input"]
+
+    code_labels = {}
+    for pk, process in processes.items():
+        if "structure" not in inputs[pk]:
+            continue  # the summary cannot be generated without the structure
+        parameters = process["extras.builder_parameters"] or {}
+        structure = inputs[pk]["structure"]
+        relax_type = parameters.get("relax_type")
+        if relax_type is None and "relax" not in inputs[pk]:
+            # Work chains submitted outside of the app have no builder parameters.
+            relax_type = "none"
+
+        yield process, generate_summary(
+            formula=get_formula_from_attributes(
+                structure["attributes.kinds"], structure["attributes.sites"]
+            ),
+            num_sites=len(structure["attributes.sites"]),
+            parameters={**parameters, "relax_type": relax_type},
+            relax="relax" in inputs[pk],
+            properties=[prop for prop in ("pdos", "bands") if prop in inputs[pk]],
+            code_labels=_get_code_labels(parameters, cache=code_labels),
+        )
+
+
+def backfill_summaries(batch_size=1000, force=False, dry_run=False):
+    """Store the summary extra on all QeAppWorkChain nodes that are missing it.
+
+    The nodes are processed in batches of ``batch_size`` nodes: the summaries of
+    each batch are generated with a single query and written with a single bulk
+    update of the node extras. Nodes whose summary cannot be generated are marked
+    with the ``UNKNOWN_SUMMARY``, so that they are not selected again.
+
+    :param force: regenerate the summaries of all nodes, even if up to date.
+    :param dry_run: generate the summaries, but do not store them.
+    :return: generator of the (number of stored summaries, number of processed
+        nodes, total number of nodes), the stored summaries are counted without
+        the marked nodes.
+    """
+    filters = {"attributes.process_label": "QeAppWorkChain"}
+    if not force:
+        filters["or"] = [
+            {"extras": {"!has_key": SUMMARY_EXTRA}},
+            {f"extras.{SUMMARY_EXTRA}.version": {"!==": SUMMARY_VERSION}},
+        ]
+    qb = QueryBuilder().append(WorkflowNode, filters=filters, project="id")
+    pks = sorted(qb.all(flat=True))
+
+    backend = get_manager().get_profile_storage()
+    num_stored = 0
+    for start in range(0, len(pks), batch_size):
+        batch = pks[start : start + batch_size]
+        summaries = {
+            process["id"]: summary
+            for process, summary in query_summaries(filters={"id": {"in": batch}})
+        }
+        num_stored += len(summaries)
+        if not dry_run:
+            # The bulk update replaces the extras, so the existing extras are included.
+            qb = QueryBuilder().append(
+                WorkflowNode, filters={"id": {"in": batch}}, project=["id", "extras"]
+            )
+            rows = [
+                {
+                    "id": pk,
+                    "extras": {
+                        **extras,
+                        SUMMARY_EXTRA: summaries.get(pk, UNKNOWN_SUMMARY),
+                    },
+                }
+                for pk, extras in qb.iterall()
+            ]
+            with backend.transaction():
+                backend.bulk_update(EntityTypes.NODE, rows)
+        yield num_stored, start + len(batch), len(pks)
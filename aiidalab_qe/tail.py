@@ -0,0 +1,237 @@
+"""Incremental reading of the output files of calculation jobs.
+
+The output files are read from the offset up to which they were read before,
+so following a growing output file only transfers the appended bytes. The
+output files of running calculation jobs are read over a transport that is
+kept open and shared by all readers of the files on the same computer.
+"""
+import os
+from contextlib import contextmanager
+from pathlib import PurePosixPath
+from threading import Lock, Timer
+from time import monotonic
+
+from aiida.common.escaping import escape_for_bash
+
+__all__ = [
+    "OutputTail",
+    "TransportPool",
+    "get_transport_pool",
+    "read_remote_tail",
+]
+
+
+class OutputTail:
+    """Read the lines appended to a growing file, starting from the last offset.
+
+    Only complete lines are returned, a partial trailing line is kept until it
+    is completed by the next read, or returned by ``flush``. The first bytes of
+    the file are kept as its ``prefix``: if the file becomes smaller than the
+    offset or its prefix changes, e.g., because it was truncated or replaced by
+    a restarted calculation, it is read again from the start.
+    """
+
+    PREFIX_SIZE = 256
+
+    def __init__(self):
+        self.offset = 0
+        self.prefix = b""
+        self._partial = b""
+
+    def reset(self):
+        self.offset = 0
+        self.prefix = b""
+        self._partial = b""
+
+    def check(self, size, prefix):
+        """Reset the tail unless the file is the one that was read so far.
+
+        :param size: the current size of the file.
+        :param prefix: the first ``len(self.prefix)`` bytes of the file.
+        :return: whether the tail was reset.
+        """
+        reset = size < self.offset or prefix != self.prefix
+        if reset:
+            self.reset()
+        return reset
+
+    def read(self, handle):
+        """Return whether the file was reset and the new lines of the file.
+
+        :param handle: the file opened in binary mode.
+        """
+        size = handle.seek(0, os.SEEK_END)
+        handle.seek(0)
+        reset = self.check(size, handle.read(len(self.prefix)))
+        handle.seek(self.offset)
+        return reset, self.feed(handle.read(size - self.offset))
+
+    def feed(self, data):
+        """Return the complete lines of the ``data`` appended at the offset."""
+        if len(self.prefix) < self.PREFIX_SIZE:
+            self.prefix += data[: self.PREFIX_SIZE - len(self.prefix)]
+        self.offset += len(data)
+        complete, newline, self._partial = (self._partial + data).rpartition(b"\n")
+        return (complete + newline).decode(errors="replace").splitlines()
+
+    def flush(self):
+        """Return the partial trailing line, once the file is complete."""
+        lines = self._partial.decode(errors="replace").splitlines()
+        self._partial = b""
+        return lines
+
+
+def read_remote_tail(transport, path, tail):
+    """Return whether the remote file was reset and the lines appended to it.
+
+    Only the bytes after the offset of the ``tail`` are transferred, they are
+    read with ``tail -c`` on the remote computer, together with the size and
+    the prefix of the file to detect whether the file was truncated or replaced.
+
+    :param transport: an open transport to the computer of the file.
+    :param path: the absolute path of the file on the computer.
+    :param tail: the ``OutputTail`` of the file.
+    :raises OSError: if the file could not be read, e.g., because it does not exist.
+    """
+    path = escape_for_bash(str(PurePosixPath(path)))
+
+    def read_from(offset, prefix_size):
+        retval, stdout, stderr = transport.exec_command_wait_bytes(
+            f"wc -c < {path} && head -c {prefix_size} {path} && "
+            f"tail -c +{offset + 1} {path}"
+        )
+        if retval != 0:
+            raise OSError(stderr.decode(errors="replace").strip())
+        size, _, data = stdout.partition(b"\n")
+        return int(size), data[:prefix_size], data[prefix_size:]
+
+    size, prefix, data = read_from(tail.offset, len(tail.prefix))
+    reset = tail.check(size, prefix)
+    if reset:
+        # The bytes read from the (old) offset are not the continuation of the
+        # lines read so far, read the file again from the start.
+        _, _, data = read_from(0, 0)
+    return reset, tail.feed(data)
+
+
+class _PooledTransport:
+    def __init__(self, transport):
+        self.transport = transport
+        self.lock = Lock()
+        self.last_used = monotonic()
+        self.refcount = 0  # number of checkouts, guarded by the lock of the pool
+
+
+class TransportPool:
+    """Keep one open transport per computer and user, shared by the output followers.
+
+    Opening a transport, e.g., an SSH connection to the login node of a cluster,
+    is expensive compared to reading the few new bytes of an output file. The
+    transports are therefore kept open and are only closed once they were not
+    used for ``idle_timeout`` seconds, checked by a timer that runs while idle
+    transports are open. Transports are not thread-safe, so each transport is
+    only used by one thread at a time.
+
+    A transport is closed if an exception is raised while it is used, since the
+    connection may be broken. Expected errors, e.g., a missing file, should be
+    handled while the transport is used.
+    """
+
+    def __init__(self, idle_timeout=300):
+        self.idle_timeout = idle_timeout
+        self._transports = {}
+        self._lock = Lock()
+        self._timer = None
+
+    @contextmanager
+    def get_transport(self, authinfo):
+        """Return a context manager for the open transport of ``authinfo``.
+
+        :param authinfo: the ``AuthInfo`` of the computer and user, e.g., as
+            returned by ``RemoteData.get_authinfo``.
+        """
+        with self._lock:
+            self._close_idle()
+            if authinfo.pk not in self._transports:
+                self._transports[authinfo.pk] = _PooledTransport(
+                    authinfo.get_transport()
+                )
+            pooled = self._transports[authinfo.pk]
+            pooled.refcount += 1
+
+        try:
+            with pooled.lock:
+                try:
+                    if not pooled.transport.is_open:
+                        pooled.transport.open()
+                    yield pooled.transport
+                except Exception:
+                    # The connection may be broken, it is reopened with the next use.
+                    self._close(pooled)
+                    raise
+        finally:
+            with self._lock:
+                pooled.refcount -= 1
+                pooled.last_used = monotonic()
+                self._schedule_close_idle()
+
+    @staticmethod
+    def _close(pooled):
+        try:
+            if pooled.transport.is_open:
+                pooled.transport.close()
+        except Exception:
+            pass
+
+    def _close_idle(self):
+        """Close the transports that were not used recently, with the pool locked."""
+        for key, pooled in list(self._transports.items()):
+            # Transports that are checked out are not idle, and they cannot be
+            # checked out while the pool is locked.
+            if pooled.refcount or monotonic() - pooled.last_used < self.idle_timeout:
+                continue
+            self._close(pooled)
+            del self._transports[key]
+
+    def _schedule_close_idle(self):
+        """Start the timer that closes the idle transports, with the pool locked.
+
+        Transports that are checked out start the timer once they are returned.
+        """
+        if self._timer is None and any(
+            not pooled.refcount for pooled in self._transports.values()
+        ):
+            self._timer = Timer(self.idle_timeout, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._close_idle()
+            self._schedule_close_idle()
+
+    def close_all(self):
+        """Close all transports, e.g., when the kernel shuts down."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for pooled in self._transports.values():
+                with pooled.lock:
+                    self._close(pooled)
+            self._transports.clear()
+
+
+_TRANSPORT_POOL = None
+_TRANSPORT_POOL_LOCK = Lock()
+
+
+def get_transport_pool():
+    """Return the transport pool of this kernel."""
+    global _TRANSPORT_POOL
+
+    with _TRANSPORT_POOL_LOCK:
+        if _TRANSPORT_POOL is None:
+            _TRANSPORT_POOL = TransportPool()
+        return _TRANSPORT_POOL
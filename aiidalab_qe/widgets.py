@@ -5,30 +5,64 @@ Authors:
     * Carl Simon Adorf <simon.adorf@epfl.ch>
 """
 
+import asyncio
 import base64
 import hashlib
-from queue import Queue
-from tempfile import NamedTemporaryFile
+import html
+import weakref
+from collections import deque
+from functools import partial
+from pathlib import PurePosixPath
 from threading import Event, Lock, Thread
 from time import time
 
 import ipywidgets as ipw
 import traitlets
 from aiida.orm import CalcJobNode, Node, load_node
+from aiida.schedulers.datastructures import JobState
 from aiidalab_widgets_base import register_viewer_widget, viewer
 from IPython.display import HTML, Javascript, clear_output, display
 
 # trigger registration of the viewer widget:
 from aiidalab_qe import node_view  # noqa: F401
+from aiidalab_qe.polling import PollResult, get_poll_scheduler
+from aiidalab_qe.tail import OutputTail, get_transport_pool, read_remote_tail
 
 __all__ = [
+    "AsyncCalcJobOutputFollower",
     "CalcJobOutputFollower",
     "LogOutputWidget",
     "NodeViewWidget",
 ]
 
+_QUEUED_STATES = (JobState.QUEUED, JobState.QUEUED_HELD)
+
+
+def _get_added_text(old, new):
+    """Return the text of the lines that ``new`` adds to ``old``.
+
+    Return None if ``new`` does not extend ``old`` by whole lines, e.g.,
+    because it changes the last line of ``old``.
+    """
+    if not new.startswith(old):
+        return None
+    added = new[len(old) :]
+    if not old or old.endswith("\n"):
+        return added
+    return added[1:] if added.startswith("\n") else None
+
 
 class RollingOutput(ipw.VBox):
+    """Show the last ``max_lines`` lines of a growing text, e.g., the output of a calcjob.
+
+    Setting the ``value`` replaces the whole text, unless the new value extends
+    the shown one, in which case only the added lines are appended. ``append``
+    adds lines to the text without updating the ``value``; use ``get_text`` to
+    get the buffered text. The lines are shown in chunks of up to ``chunk_lines`` lines, so that
+    appended lines only update the last chunk in the front end, instead of the
+    whole text. While ``auto_scroll`` is enabled, the output stays scrolled to
+    the bottom by reversing the flow of the scrolled box.
+    """
 
     style = (
         "background-color: #253239; color: #cdd3df; line-height: normal; custom=test"
@@ -37,24 +71,43 @@ class RollingOutput(ipw.VBox):
     value = traitlets.Unicode()
     auto_scroll = traitlets.Bool()
 
-    def __init__(self, num_min_lines=10, max_output_height="200px", **kwargs):
+    def __init__(
+        self,
+        num_min_lines=10,
+        max_output_height="200px",
+        max_lines=10000,
+        chunk_lines=100,
+        **kwargs,
+    ):
         self._num_min_lines = num_min_lines
-        self._output = ipw.HTML(layout=ipw.Layout(min_width="50em"))
+        self._max_lines = max_lines
+        self._chunk_lines = chunk_lines
+        self._num_lines = 0
+        self._chunks = deque()  # of [ipw.HTML, lines]
+        self._value_shown = False  # whether the output shows exactly the value
+        self._padding = ipw.HTML()
+        self._output = ipw.VBox(
+            [self._padding], layout=ipw.Layout(min_width="50em", flex="none")
+        )
         self._refresh_output()
         super().__init__(
             [self._output],
-            layout=ipw.Layout(max_height=max_output_height, min_width="51em"),
+            layout=ipw.Layout(
+                max_height=max_output_height, min_width="51em", overflow="auto"
+            ),
         )
-
-    @traitlets.default("value")
-    def _default_value(self):
-        if self._num_min_lines > 0:
-            return "\n" * self._num_min_lines
+        self._observe_auto_scroll()
 
     @traitlets.default("auto_scroll")
     def _default_auto_scroll(self):
         return True
 
+    @traitlets.observe("auto_scroll")
+    def _observe_auto_scroll(self, _=None):
+        # A box with a reversed flow keeps its scroll position at the bottom
+        # when content is added, as long as it is scrolled to the bottom.
+        self.layout.flex_flow = "column-reverse" if self.auto_scroll else "column"
+
     def scroll_to_bottom(self):
         # Slight hack because it will scroll all widgets with the same class
         # name and max height to the bottom. That would primarily be an issue in
@@ -73,33 +126,97 @@ class RollingOutput(ipw.VBox):
         )
 
     @traitlets.observe("value")
-    def _refresh_output(self, _=None):
-        self._output.value = self._format_output(self.value)
-        if self.auto_scroll:
-            self.scroll_to_bottom()
-
-    def _format_output(self, text):
-        lines = text.splitlines()
+    def _refresh_output(self, change=None):
+        value = self.value or ""
+        added = None
+        if change and self._value_shown:
+            added = _get_added_text(change["old"] or "", value)
+        if added is None:
+            self.clear()
+            added = value
+        self.append(added.splitlines())
+        self._value_shown = True
+
+    def get_text(self):
+        """Return the lines in the output, joined by newlines."""
+        return "\n".join(line for _, lines in self._chunks for line in lines)
+
+    def clear(self):
+        """Remove all lines from the output."""
+        for widget, _ in self._chunks:
+            widget.close()
+        self._chunks.clear()
+        self._num_lines = 0
+        self._output.children = [self._padding]
+        self._value_shown = False
+        self._update_padding()
+
+    def append(self, lines):
+        """Append the ``lines`` to the output."""
+        lines = lines[-self._max_lines :]
+        self._value_shown = False
+        children_changed = False
+        updated = {}  # the chunks to update, by id
+
+        for line in lines:
+            if not self._chunks or len(self._chunks[-1][1]) >= self._chunk_lines:
+                self._chunks.append([ipw.HTML(), []])
+                children_changed = True
+            chunk = self._chunks[-1]
+            chunk[1].append(line)
+            updated[id(chunk)] = chunk
+        self._num_lines += len(lines)
+
+        # Drop the oldest lines, to show no more than the maximum number of lines.
+        while self._num_lines > self._max_lines:
+            chunk = self._chunks[0]
+            excess = self._num_lines - self._max_lines
+            if excess < len(chunk[1]):
+                del chunk[1][:excess]
+                updated[id(chunk)] = chunk
+                self._num_lines -= excess
+            else:
+                self._chunks.popleft()
+                chunk[0].close()
+                updated.pop(id(chunk), None)
+                children_changed = True
+                self._num_lines -= len(chunk[1])
+
+        for widget, chunk_lines in updated.values():
+            widget.value = self._format_lines(chunk_lines)
+        if children_changed:
+            self._output.children = [self._padding] + [
+                widget for widget, _ in self._chunks
+            ]
+        self._update_padding()
 
+    def _update_padding(self):
         # Add empty lines to reach the minimum number of lines.
-        lines += [""] * max(0, self._num_min_lines - len(lines))
+        num_padding_lines = max(0, self._num_min_lines - self._num_lines)
+        self._padding.value = (
+            self._format_lines([" "] * num_padding_lines) if num_padding_lines else ""
+        )
 
+    def _format_lines(self, lines):
         # Replace empty lines with single white space to ensure that they are
         # actually shown.
-        lines = [line if len(line) > 0 else " " for line in lines]
-
-        text = "\n".join(lines)
-        return f"""<pre style="{self.style}">{text}</pre>"""
+        text = "\n".join(html.escape(line) or " " for line in lines)
+        return f"""<pre style="{self.style}; margin: 0">{text}</pre>"""
 
 
 class DownloadButton(ipw.Button):
     # Adapted from https://stackoverflow.com/a/68683463
-    """A Button widget for downloads with dynamic content."""
+    """A Button widget for downloads with dynamic content.
+
+    :param get_payload: optional function that returns the payload when the
+        button is clicked, instead of the ``payload``.
+    """
 
     filename = traitlets.Unicode()
     payload = traitlets.Bytes()
 
-    def __init__(self, **kwargs):
+    def __init__(self, get_payload=None, **kwargs):
+        self._get_payload = get_payload
         super().__init__(**kwargs)
         self.on_click(self.__on_click)
 
@@ -112,8 +229,9 @@ class DownloadButton(ipw.Button):
         return "Download"
 
     def __on_click(self, _):
-        digest = hashlib.md5(self.payload).hexdigest()  # bypass browser cache
-        payload = base64.b64encode(self.payload).decode()
+        payload = self._get_payload() if self._get_payload else self.payload
+        digest = hashlib.md5(payload).hexdigest()  # bypass browser cache
+        payload = base64.b64encode(payload).decode()
 
         id = f"dl_{digest}"
 
@@ -163,19 +281,26 @@ class FilenameDisplayWidget(ipw.Box):
 
 
 class LogOutputWidget(ipw.VBox):
+    """Show a log, e.g., the output of a calcjob, with buttons to download and scroll it.
+
+    Setting the ``value`` replaces the whole log, unless the new value extends
+    the shown one, while ``append`` only sends the new lines to the front end,
+    without updating the ``value``.
+
+    :param get_payload: optional function that returns the complete log to
+        download, e.g., read from its file. By default, the shown lines are
+        downloaded.
+    """
 
     filename = traitlets.Unicode()
     value = traitlets.Unicode()
 
-    def __init__(self, placeholder=None, **kwargs):
+    def __init__(self, placeholder=None, get_payload=None, **kwargs):
         self.placeholder = placeholder
+        self._has_output = False
+        self._value_shown = False  # whether the log shows exactly the value
 
         self._rolling_output = RollingOutput(layout=ipw.Layout(flex="1 1 auto"))
-        ipw.dlink(
-            (self, "value"),
-            (self._rolling_output, "value"),
-            lambda value: value or self.placeholder or "",
-        )
 
         self._filename_display = FilenameDisplayWidget(
             layout=ipw.Layout(width="auto"), max_width="55em"
@@ -187,15 +312,11 @@ class LogOutputWidget(ipw.VBox):
         )
 
         self._btn_download = DownloadButton(
+            get_payload=get_payload or (lambda: self.get_text().encode("utf-8")),
             layout=ipw.Layout(width="30px", flex="5 1 auto"),
             disabled=True,
         )
         ipw.dlink((self, "filename"), (self._btn_download, "filename"))
-        ipw.dlink(
-            (self, "value"),
-            (self._btn_download, "payload"),
-            transform=lambda value: value.encode("utf-8"),
-        )
 
         self._btn_scroll_down = ipw.Button(
             icon="angle-double-down",
@@ -229,6 +350,7 @@ class LogOutputWidget(ipw.VBox):
             ],
             **kwargs,
         )
+        self.clear()
 
     @traitlets.default("placeholder")
     def _default_placeholder(self):
@@ -236,28 +358,74 @@ class LogOutputWidget(ipw.VBox):
 
     @traitlets.observe("value")
     def _observe_value(self, change):
-        self._btn_download.disabled = not change["new"]
-        self._btn_scroll_down.disabled = not change["new"]
+        added = None
+        if self._value_shown:
+            added = _get_added_text(change["old"], change["new"])
+        if added is None:
+            self.clear()
+            added = change["new"]
+        self.append(added.splitlines())
+        self._value_shown = True
+
+    def get_text(self):
+        """Return the shown lines of the log, joined by newlines."""
+        return self._rolling_output.get_text() if self._has_output else ""
+
+    def clear(self):
+        """Remove all lines from the log and show the placeholder."""
+        self._has_output = False
+        self._value_shown = False
+        self._rolling_output.clear()
+        self._rolling_output.append((self.placeholder or "").splitlines())
+        self._btn_download.disabled = True
+        self._btn_scroll_down.disabled = True
+
+    def append(self, lines):
+        """Append the ``lines`` to the log."""
+        if not lines:
+            return
+        self._value_shown = False
+        if not self._has_output:
+            self._has_output = True
+            self._rolling_output.clear()  # remove the placeholder
+            self._btn_download.disabled = False
+            self._btn_scroll_down.disabled = False
+        self._rolling_output.append(lines)
 
 
 class CalcJobOutputFollower(traitlets.HasTraits):
+    """Follow the output file of a calcjob, while it is written.
+
+    The callbacks registered with ``on_output`` receive only the new lines of
+    the output, ``output`` keeps the last ``max_lines`` lines and ``lineno``
+    counts all lines. The ``output`` is updated in place, but its observers are
+    notified of each update.
+    """
 
     calcjob_uuid = traitlets.Unicode(allow_none=True)
     filename = traitlets.Unicode(allow_none=True)
-    output = traitlets.List(trait=traitlets.Unicode)
+    output = traitlets.Instance(deque)
     lineno = traitlets.Int()
 
-    def __init__(self, **kwargs):
-        self._output_queue = Queue()
-
+    def __init__(self, max_lines=10000, **kwargs):
         self._lock = Lock()
-        self._push_thread = None
-        self._pull_thread = None
-        self._stop_follow_output = Event()
-        self._follow_output_thread = None
-
+        self._poll_task = None
+        self._tail = None
+        self._output_callbacks = ipw.CallbackDispatcher()
+        self.output = deque(maxlen=max_lines)
         super().__init__(**kwargs)
 
+    def on_output(self, callback, remove=False):
+        """Register a callback to execute when lines are appended to the output.
+
+        The callback is called with whether the output was reset, e.g., because
+        the output file was replaced or another calcjob is followed, and the new
+        lines. It may be called from another thread.
+
+        :param remove: whether to unregister the callback.
+        """
+        self._output_callbacks.register_callback(callback, remove=remove)
+
     @traitlets.observe("calcjob_uuid")
     def _observe_calcjob(self, change):
         calcjob_uuid = change["new"]
@@ -266,105 +434,234 @@ class CalcJobOutputFollower(traitlets.HasTraits):
 
         with self._lock:
             # Stop following
-            self._stop_follow_output.set()
+            self._stop_following()
 
-            if self._follow_output_thread:
-                self._follow_output_thread.join()
-                self._follow_output_thread = None
-
-            # Reset all traitlets and signals.
-            self.output.clear()
-            self.lineno = 0
-            self._stop_follow_output.clear()
+            # Reset all traitlets.
+            self._append_output(True, [])
 
             # (Re/)start following
-            if change["new"]:
-                self._follow_output_thread = Thread(
-                    target=self._follow_output, args=(calcjob_uuid,)
-                )
-                self._follow_output_thread.start()
+            if calcjob_uuid:
+                self._tail = OutputTail()
+                self._start_following(calcjob_uuid, self._tail)
 
-    def _follow_output(self, calcjob_uuid):
-        """Monitor calcjob and orchestrate pushing and pulling of output."""
-        self._pull_thread = Thread(target=self._pull_output)
-        self._pull_thread.start()
-        self._push_thread = Thread(target=self._push_output, args=(calcjob_uuid,))
-        self._push_thread.start()
+    def _start_following(self, calcjob_uuid, tail):
+        self._poll_task = get_poll_scheduler().add(
+            partial(self._poll_output, calcjob_uuid, tail)
+        )
+
+    def _stop_following(self):
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        self._tail = None
 
-    def _fetch_output(self, calcjob):
+    def _fetch_output(self, calcjob, tail):
+        """Return whether the output was reset and the lines appended to the output.
+
+        :param tail: the ``OutputTail`` of the output file of the calcjob.
+        """
         assert isinstance(calcjob, CalcJobNode)
         if "retrieved" in calcjob.outputs:
             try:
                 self.filename = calcjob.base.attributes.get("output_filename")
-                with calcjob.outputs.retrieved.base.repository.open(self.filename) as f:
-                    return f.read().splitlines()
+                with calcjob.outputs.retrieved.base.repository.open(
+                    self.filename, "rb"
+                ) as f:
+                    return tail.read(f)
             except OSError:
-                return list()
+                return False, list()
 
         elif "remote_folder" in calcjob.outputs:
             try:
                 fn_out = calcjob.base.attributes.get("output_filename")
                 self.filename = fn_out
-                with NamedTemporaryFile() as tmpfile:
-                    calcjob.outputs.remote_folder.getfile(fn_out, tmpfile.name)
-                    return tmpfile.read().decode().splitlines()
+                remote_folder = calcjob.outputs.remote_folder
+                with get_transport_pool().get_transport(
+                    remote_folder.get_authinfo()
+                ) as transport:
+                    try:
+                        return read_remote_tail(
+                            transport,
+                            PurePosixPath(remote_folder.get_remote_path(), fn_out),
+                            tail,
+                        )
+                    except OSError:
+                        # The output file does not exist yet, the transport is
+                        # kept open, unlike for errors of the transport.
+                        return False, list()
             except OSError:
-                return list()
+                return False, list()
         else:
-            return list()
+            return False, list()
 
-    _EOF = None
-
-    def _push_output(self, calcjob_uuid, delay=0.2):
-        """Push new log lines onto the queue."""
-        lineno = 0
+    def _read_output(self, calcjob_uuid, tail):
+        """Return the ``PollResult``, whether the output was reset and the new lines."""
         calcjob = load_node(calcjob_uuid)
-        while True:
-            try:
-                lines = self._fetch_output(calcjob)
-            except Exception as error:
-                self._output_queue.put([f"[ERROR: {error}]"])
-            else:
-                self._output_queue.put(lines[lineno:])
-                lineno = len(lines)
-            finally:
-                if calcjob.is_sealed or self._stop_follow_output.wait(delay):
-                    # Pushing EOF signals to the pull thread to stop.
-                    self._output_queue.put(self._EOF)
-                    break  # noqa: B012
-
-    def _pull_output(self):
-        """Pull new log lines from the queue and update traitlets."""
-        while True:
-            item = self._output_queue.get()
-            if item is self._EOF:
-                self._output_queue.task_done()
-                break
-            else:  # item is 'new lines'
-                with self.hold_trait_notifications():
-                    self.output.extend(item)
-                    self.lineno += len(item)
-                self._output_queue.task_done()
+        # The output is complete once the calcjob is sealed.
+        complete = calcjob.is_sealed
+        if not complete and calcjob.get_scheduler_state() in _QUEUED_STATES:
+            return PollResult.WAITING, False, list()
+
+        offset = tail.offset
+        try:
+            reset, lines = self._fetch_output(calcjob, tail)
+        except Exception as error:
+            reset, lines = False, [f"[ERROR: {error}]"]
+
+        if complete:
+            return PollResult.DONE, reset, lines + tail.flush()
+        elif reset or tail.offset != offset:
+            return PollResult.CHANGED, reset, lines
+        return PollResult.UNCHANGED, reset, lines
+
+    def read_output(self):
+        """Return the complete output of the followed calcjob, e.g., to download it."""
+        if not self.calcjob_uuid:
+            return ""
+        tail = OutputTail()
+        _, lines = self._fetch_output(load_node(self.calcjob_uuid), tail)
+        return "\n".join(lines + tail.flush())
+
+    def _append_output(self, reset, lines):
+        if not (reset or lines):
+            return
+        with self.hold_trait_notifications():
+            if reset:
+                # The output file was truncated or replaced.
+                self.output.clear()
+                self.lineno = 0
+            self.output.extend(lines)
+            self.lineno += len(lines)
+        self.notify_change(
+            traitlets.Bunch(
+                name="output",
+                old=self.output,
+                new=self.output,
+                owner=self,
+                type="change",
+            )
+        )
+        self._output_callbacks(reset, lines)
+
+    def _poll_output(self, calcjob_uuid, tail):
+        """Append the new lines of the output and return the ``PollResult``."""
+        result, reset, lines = self._read_output(calcjob_uuid, tail)
+        with self._lock:
+            if self._tail is not tail:
+                return PollResult.DONE  # following another calcjob
+            self._append_output(reset, lines)
+        return result
+
+
+class _OutputFlusher:
+    """Append the queued output of all followers on an event loop in one callback."""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._lock = Lock()
+        self._followers = {}  # ordered set of the followers with queued output
+        self._scheduled = False
+
+    def queue(self, follower):
+        """Flush the output of ``follower`` in the next iteration of the loop."""
+        with self._lock:
+            self._followers[follower] = None
+            if not self._scheduled:
+                self._scheduled = True
+                self._loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        with self._lock:
+            followers = list(self._followers)
+            self._followers.clear()
+            self._scheduled = False
+        for follower in followers:
+            follower._flush_output()
+
+
+_OUTPUT_FLUSHERS = weakref.WeakKeyDictionary()
+_OUTPUT_FLUSHERS_LOCK = Lock()
+
+
+def _get_output_flusher(loop):
+    with _OUTPUT_FLUSHERS_LOCK:
+        if loop not in _OUTPUT_FLUSHERS:
+            _OUTPUT_FLUSHERS[loop] = _OutputFlusher(loop)
+        return _OUTPUT_FLUSHERS[loop]
+
+
+class AsyncCalcJobOutputFollower(CalcJobOutputFollower):
+    """Follow the output of a calcjob, updating the traitlets on the event loop of the kernel.
+
+    The output is read by the shared poll scheduler, like for the threaded
+    follower, but the new lines are only appended on the event loop. The output
+    of all followers on the loop is appended in a single callback per iteration
+    of the loop, instead of from the threads of the scheduler.
+    """
+
+    def __init__(self, loop=None, **kwargs):
+        self._flusher = _get_output_flusher(loop or asyncio.get_event_loop())
+        self._pending = None
+        super().__init__(**kwargs)
+
+    def _stop_following(self):
+        super()._stop_following()
+        self._pending = None
+
+    def _poll_output(self, calcjob_uuid, tail):
+        """Queue the new lines of the output and return the ``PollResult``."""
+        result, reset, lines = self._read_output(calcjob_uuid, tail)
+        with self._lock:
+            if self._tail is not tail:
+                return PollResult.DONE  # following another calcjob
+            if self._pending is None:
+                self._pending = (False, [])
+                self._flusher.queue(self)
+            if reset:
+                self._pending = (True, [])
+            self._pending[1].extend(lines)
+        return result
+
+    def _flush_output(self):
+        with self._lock:
+            if self._pending is None:
+                return
+            reset, lines = self._pending
+            self._pending = None
+            self._append_output(reset, lines)
 
 
 @register_viewer_widget("process.calculation.calcjob.CalcJobNode.")
 class CalcJobNodeViewerWidget(ipw.VBox):
-    def __init__(self, calcjob, **kwargs):
+    """Show the output of a calcjob, while it is written.
+
+    :param follower_class: the class of the ``CalcJobOutputFollower`` of the output,
+        e.g., ``AsyncCalcJobOutputFollower`` to follow it on the event loop of the kernel.
+    """
+
+    def __init__(self, calcjob, follower_class=CalcJobOutputFollower, **kwargs):
         self.calcjob = calcjob
-        self.output_follower = CalcJobOutputFollower()
-        self.log_output = LogOutputWidget()
+        self.output_follower = follower_class()
+        self.log_output = LogOutputWidget(
+            get_payload=lambda: self.output_follower.read_output().encode("utf-8")
+        )
 
+        ipw.dlink(
+            (self.output_follower, "filename"),
+            (self.log_output, "filename"),
+            lambda filename: filename or "",
+        )
+        self.output_follower.on_output(self._on_output)
         self.output_follower.calcjob_uuid = self.calcjob.uuid
-        self.output_follower.observe(self._observe_output_follower_lineno, ["lineno"])
 
         super().__init__(
             [ipw.HTML(f"CalcJob: {self.calcjob}"), self.log_output], **kwargs
         )
 
-    def _observe_output_follower_lineno(self, _):
-        with self.hold_trait_notifications():
-            self.log_output.filename = self.output_follower.filename
-            self.log_output.value = "\n".join(self.output_follower.output)
+    def _on_output(self, reset, lines):
+        if reset:
+            self.log_output.clear()
+        self.log_output.append(lines)
 
 
 class NodeViewWidget(ipw.VBox):
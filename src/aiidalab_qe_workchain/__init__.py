@@ -1,7 +1,7 @@
 # AiiDA imports.
-from aiida.common import AttributeDict
+from aiida.common import AttributeDict, LinkType
 from aiida.engine import ToContext, WorkChain, if_
-from aiida.orm import CalcJobNode, WorkChainNode
+from aiida.orm import CalcJobNode, QueryBuilder, WorkChainNode, WorkflowNode
 from aiida.plugins import DataFactory, WorkflowFactory
 
 # AiiDA Quantum ESPRESSO plugin inputs.
@@ -20,9 +20,54 @@ Str = DataFactory("core.str")
 XyData = DataFactory("core.array.xy")
 StructureData = DataFactory("core.structure")
 BandsData = DataFactory("core.array.bands")
+RemoteData = DataFactory("core.remote")
 Orbital = DataFactory("core.orbital")
 
 
+def get_called_workflow_pks(node):
+    """Return the pks of the workflow ``node`` and of the workflows it called, recursively.
+
+    The recursive joins of the ``QueryBuilder`` only follow data provenance links,
+    not CALL links, so the called workflows are queried one nesting level at a
+    time, with one query of their pks per level. None of them are loaded.
+    """
+    workflow_pks = [node.pk]
+    callers = [node.pk]
+    while callers:
+        qb = QueryBuilder()
+        qb.append(WorkflowNode, filters={"id": {"in": callers}}, tag="caller")
+        qb.append(
+            WorkflowNode,
+            with_incoming="caller",
+            edge_filters={"type": LinkType.CALL_WORK.value},
+            project="id",
+        )
+        callers = qb.all(flat=True)
+        workflow_pks.extend(callers)
+    return workflow_pks
+
+
+def get_called_calcjobs_query(workflow_pks, filters=None):
+    """Return a ``QueryBuilder`` for the calculation jobs called by the workflows ``workflow_pks``.
+
+    The calculation jobs are appended with the tag "calcjob" and are not projected,
+    so that the query can be extended.
+
+    :param workflow_pks: the pks of the workflows, e.g., from ``get_called_workflow_pks``.
+    :param filters: ``QueryBuilder`` filters applied to the calculation jobs.
+    """
+    qb = QueryBuilder()
+    qb.append(WorkflowNode, filters={"id": {"in": workflow_pks}}, tag="caller")
+    qb.append(
+        CalcJobNode,
+        with_incoming="caller",
+        edge_filters={"type": LinkType.CALL_CALC.value},
+        filters=filters or {},
+        tag="calcjob",
+    )
+    return qb
+
+
 class QeAppWorkChain(WorkChain):
     """WorkChain designed to calculate the requested properties in the AiiDAlab Quantum ESPRESSO app."""
 
@@ -378,13 +423,20 @@ class QeAppWorkChain(WorkChain):
 
         cleaned_calcs = []
 
-        for called_descendant in self.node.called_descendants:
-            if isinstance(called_descendant, CalcJobNode):
-                try:
-                    called_descendant.outputs.remote_folder._clean()  # pylint: disable=protected-access
-                    cleaned_calcs.append(called_descendant.pk)
-                except (OSError, KeyError):
-                    pass
+        qb = get_called_calcjobs_query(get_called_workflow_pks(self.node))
+        qb.add_projection("calcjob", "id")
+        qb.append(
+            RemoteData,
+            with_incoming="calcjob",
+            edge_filters={"label": "remote_folder"},
+            project="*",
+        )
+        for pk, remote_folder in qb.iterall():
+            try:
+                remote_folder._clean()  # pylint: disable=protected-access
+                cleaned_calcs.append(pk)
+            except OSError:
+                pass
 
         if cleaned_calcs:
             self.report(
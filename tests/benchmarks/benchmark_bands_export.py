@@ -0,0 +1,74 @@
+"""Compare the band structure plot data export through the JSON export format
+of ``BandsData`` with the direct extraction from its arrays.
+
+Run with ``python tests/benchmarks/benchmark_bands_export.py`` in an environment
+with a configured AiiDA profile.
+"""
+import json
+import timeit
+
+import numpy as np
+from aiida import load_profile
+from aiida.orm import BandsData
+from monty.json import jsanitize
+
+load_profile()
+
+from aiidalab_qe.node_view import _get_bands_plot_data  # noqa: E402
+
+NUM_KPOINTS = 2000
+NUM_BANDS = 400
+REPEAT = 5
+
+
+def get_bands_data(num_kpoints=NUM_KPOINTS, num_bands=NUM_BANDS):
+    """Return a band structure along the path G-X|Y-G of a cubic cell."""
+    bands_data = BandsData()
+    bands_data.set_cell(np.eye(3) * 5.0)
+    half = num_kpoints // 2
+    kpoints = np.concatenate(
+        [
+            np.linspace([0.0, 0.0, 0.0], [0.5, 0.0, 0.0], half),
+            np.linspace([0.0, 0.5, 0.0], [0.0, 0.0, 0.0], num_kpoints - half),
+        ]
+    )
+    bands_data.set_kpoints(kpoints)
+    bands_data.labels = [(0, "G"), (half - 1, "X"), (half, "Y"), (num_kpoints - 1, "G")]
+    rng = np.random.default_rng(seed=0)
+    bands_data.set_bands(np.sort(rng.uniform(-20, 20, (num_kpoints, num_bands))))
+    return bands_data
+
+
+def export_through_json(bands_data):
+    return jsanitize(json.loads(bands_data._exportcontent("json", comments=False)[0]))
+
+
+def assert_same_plot_data(expected, actual):
+    """Assert that the plot data are equal, up to rounding errors of the arrays."""
+    assert len(expected["paths"]) == len(actual["paths"])
+    for expected_path, actual_path in zip(expected.pop("paths"), actual.pop("paths")):
+        for key in ("x", "values"):
+            assert np.allclose(expected_path.pop(key), actual_path.pop(key))
+        assert expected_path == actual_path
+    assert expected == actual
+
+
+def main():
+    bands_data = get_bands_data()
+
+    assert_same_plot_data(
+        export_through_json(bands_data), _get_bands_plot_data(bands_data)
+    )
+
+    print(f"Band structure with {NUM_KPOINTS} k-points and {NUM_BANDS} bands:")
+    for name, export in [
+        ("JSON export format", lambda: export_through_json(bands_data)),
+        ("direct", lambda: _get_bands_plot_data(bands_data)),
+        ("direct (arrays)", lambda: _get_bands_plot_data(bands_data, as_lists=False)),
+    ]:
+        seconds = min(timeit.repeat(export, number=1, repeat=REPEAT))
+        print(f"{name:>20}: {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import io
+import json
+import zipfile
+from pathlib import PurePosixPath
+
+import pytest
+
+pytest.importorskip("aiida.tools.pytest_fixtures")
+
+from aiida.common import LinkType  # noqa: E402
+from aiida.engine import ProcessState  # noqa: E402
+from aiida.orm import (  # noqa: E402
+    CalcJobNode,
+    FolderData,
+    SinglefileData,
+    WorkChainNode,
+)
+from aiida.tools.pytest_fixtures import *  # noqa: E402,F401,F403
+
+from aiidalab_qe.archive import (  # noqa: E402
+    EXPORT_PROFILES,
+    ArchiveJobService,
+    ArchiveOptions,
+    estimate_archive_size,
+    get_archive_files,
+    get_archive_path,
+    write_archive,
+)
+
+# The folders of the calcjobs of the work chain created by ``make_work_chain``.
+FOLDERS = ["01-relax-iter1-pw1", "02-relax-iter1-pw2"]
+
+
+def make_work_chain(num_calcjobs=0):
+    """Return a QeAppWorkChain node that called ``num_calcjobs`` pw.x calcjobs.
+
+    The calcjobs are called by the base work chain of the "relax" sub-workflow.
+    They share the same pseudopotential and write the same XML output file, but
+    different output files.
+    """
+    node = WorkChainNode()
+    node.set_process_label("QeAppWorkChain")
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(0)
+    node.store()
+    if not num_calcjobs:
+        return node
+
+    relax = WorkChainNode()
+    relax.base.links.add_incoming(node, LinkType.CALL_WORK, "relax")
+    relax.store()
+    base = WorkChainNode()
+    base.base.links.add_incoming(relax, LinkType.CALL_WORK, "iteration_01")
+    base.store()
+
+    pseudo = SinglefileData(io.BytesIO(b"<UPF Si>\n" * 100), filename="Si.upf")
+    pseudo.store()
+    for index in range(1, num_calcjobs + 1):
+        calcjob = CalcJobNode()
+        calcjob.set_option("input_filename", "aiida.in")
+        calcjob.set_process_state(ProcessState.FINISHED)
+        calcjob.set_exit_status(0)
+        calcjob.base.repository.put_object_from_bytes(
+            f"&control iteration {index}\n".encode(), "aiida.in"
+        )
+        calcjob.base.links.add_incoming(base, LinkType.CALL_CALC, f"iteration_0{index}")
+        calcjob.base.links.add_incoming(pseudo, LinkType.INPUT_CALC, "pseudos__Si")
+        calcjob.store()
+
+        retrieved = FolderData()
+        retrieved.base.repository.put_object_from_bytes(
+            f"iteration {index}\n".encode() * 100, "aiida.out"
+        )
+        retrieved.base.repository.put_object_from_bytes(
+            b"<xml/>", "data-file-schema.xml"
+        )
+        retrieved.base.repository.put_object_from_bytes(
+            bytes([index]) * 10000, "out/aiida.wfc1"
+        )
+        retrieved.base.links.add_incoming(calcjob, LinkType.CREATE, "retrieved")
+        retrieved.store()
+    return node
+
+
+def get_arcnames(node, options=None):
+    files, _ = get_archive_files(node, options)
+    return sorted(files)
+
+
+def get_calcjob_arcnames(folder, inputs=True, outputs=True):
+    arcnames = []
+    if inputs:
+        arcnames += [f"{folder}/aiida.in", f"{folder}/pseudo/Si.upf"]
+    if outputs:
+        arcnames += [
+            f"{folder}/aiida.out",
+            f"{folder}/data-file-schema.xml",
+            f"{folder}/out/aiida.wfc1",
+        ]
+    return arcnames
+
+
+def test_archive_without_calcjobs(tmp_path):
+    node = make_work_chain()
+    assert estimate_archive_size(node) == (0, 0)
+
+    path = tmp_path / "archive.zip"
+    write_archive(node, path)
+    with zipfile.ZipFile(path) as archive:
+        assert archive.namelist() == []
+
+
+def test_archive(tmp_path):
+    node = make_work_chain(num_calcjobs=2)
+    arcnames = [
+        arcname for folder in FOLDERS for arcname in get_calcjob_arcnames(folder)
+    ]
+    assert get_arcnames(node) == sorted(arcnames)
+    assert estimate_archive_size(node)[0] == len(arcnames)
+
+    path = tmp_path / "archive.zip"
+    write_archive(node, path)
+    with zipfile.ZipFile(path) as archive:
+        assert sorted(archive.namelist()) == sorted(arcnames)
+        assert archive.read(f"{FOLDERS[1]}/aiida.in") == b"&control iteration 2\n"
+
+
+def test_archive_deduplicate(tmp_path):
+    node = make_work_chain(num_calcjobs=2)
+    path = tmp_path / "archive.zip"
+    write_archive(node, path, ArchiveOptions(deduplicate=True))
+
+    with zipfile.ZipFile(path) as archive:
+        arcnames = archive.namelist()
+        shared = {
+            PurePosixPath(arcname).name: arcname
+            for arcname in arcnames
+            if arcname.startswith("shared/")
+        }
+        # The identical files of both calcjobs are stored once, in a folder
+        # named by the key of their content.
+        assert sorted(shared) == ["Si.upf", "data-file-schema.xml"]
+        for arcname in shared.values():
+            assert len(PurePosixPath(arcname).parts) == 3
+
+        for folder in FOLDERS:
+            assert f"{folder}/pseudo/Si.upf" not in arcnames
+            assert f"{folder}/data-file-schema.xml" not in arcnames
+            assert f"{folder}/aiida.out" in arcnames
+            manifest = json.loads(archive.read(f"{folder}/manifest.json"))
+            assert manifest == {
+                "pseudo/Si.upf": f"../{shared['Si.upf']}",
+                "data-file-schema.xml": f"../{shared['data-file-schema.xml']}",
+            }
+        assert archive.read(shared["Si.upf"]) == b"<UPF Si>\n" * 100
+
+
+def test_archive_exclude():
+    node = make_work_chain(num_calcjobs=2)
+    options = ArchiveOptions(exclude=("*.wfc*", "data-file-schema.xml"))
+    assert get_arcnames(node, options) == sorted(
+        f"{folder}/{name}"
+        for folder in FOLDERS
+        for name in ("aiida.in", "pseudo/Si.upf", "aiida.out")
+    )
+    options = ArchiveOptions(exclude=("out/*",))
+    assert f"{FOLDERS[0]}/out/aiida.wfc1" not in get_arcnames(node, options)
+
+
+def test_archive_max_file_size():
+    node = make_work_chain(num_calcjobs=2)
+    arcnames = get_arcnames(node, ArchiveOptions(max_file_size=5000))
+    assert arcnames == sorted(
+        arcname
+        for folder in FOLDERS
+        for arcname in get_calcjob_arcnames(folder)
+        if not arcname.endswith(".wfc1")
+    )
+    num_files, size = estimate_archive_size(node, ArchiveOptions(max_file_size=5000))
+    assert num_files == len(arcnames)
+    assert size < 10000
+
+
+@pytest.mark.parametrize(
+    "profile, folders, inputs, outputs",
+    [
+        ("All files", FOLDERS, True, True),
+        ("Final calculation only", FOLDERS[-1:], True, True),
+        ("Inputs only", FOLDERS, True, False),
+        ("Outputs only", FOLDERS, False, True),
+    ],
+)
+def test_export_profiles(profile, folders, inputs, outputs):
+    node = make_work_chain(num_calcjobs=2)
+    assert get_arcnames(node, EXPORT_PROFILES[profile]) == sorted(
+        arcname
+        for folder in folders
+        for arcname in get_calcjob_arcnames(folder, inputs, outputs)
+    )
+
+
+def test_archive_job(tmp_path):
+    node = make_work_chain(num_calcjobs=1)
+    job = ArchiveJobService().submit(node, export_dir=tmp_path)
+    assert job.wait(timeout=30)
+    assert job.error is None
+    assert job.path == get_archive_path(node, export_dir=tmp_path)
+    # The lock file is deleted once the archive is written.
+    assert [path.name for path in tmp_path.iterdir()] == [job.path.name]
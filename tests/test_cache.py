@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+
+from aiidalab_qe.cache import ResultsCache
+
+
+def test_round_trip(tmp_path):
+    cache = ResultsCache(tmp_path)
+    key = ["export_data-v1", "work_chain:uuid"]
+    assert cache.get(key) is None
+
+    payload = {
+        "label": "bands",
+        "values": np.arange(6, dtype=np.float32).reshape(2, 3),
+        "paths": [{"x": np.linspace(0, 1, 5), "two_band_types": False}],
+        "fermi_level": 1.5,
+        "missing": None,
+    }
+    cache.set(key, payload)
+    cached = cache.get(key)
+
+    assert cached["label"] == "bands"
+    assert cached["values"].dtype == np.float32
+    np.testing.assert_array_equal(cached["values"], payload["values"])
+    np.testing.assert_array_equal(cached["paths"][0]["x"], payload["paths"][0]["x"])
+    assert cached["paths"][0]["two_band_types"] is False
+    assert cached["fermi_level"] == 1.5
+    assert cached["missing"] is None
+
+    assert cache.get(["export_data-v2", "work_chain:uuid"]) is None
+
+
+def test_get_or_compute(tmp_path):
+    cache = ResultsCache(tmp_path)
+    calls = []
+
+    def compute():
+        calls.append(None)
+        return {"value": 1}
+
+    assert cache.get_or_compute(["key"], compute) == {"value": 1}
+    assert cache.get_or_compute(["key"], compute) == {"value": 1}
+    assert len(calls) == 1
+
+
+def test_evict_least_recently_used(tmp_path):
+    payload = {"data": np.random.default_rng(seed=0).random(1000)}
+    cache = ResultsCache(tmp_path)
+    cache.set(["first"], payload)
+    size = cache._get_path(["first"]).stat().st_size
+
+    # The cache holds two entries, the least recently used is evicted.
+    cache.max_size = int(2.5 * size)
+    cache.set(["second"], payload)
+    past = cache._get_path(["second"]).stat().st_mtime - 60
+    for name in ("first", "second"):
+        os.utime(cache._get_path([name]), (past, past))
+    assert cache.get(["first"]) is not None  # marks it as recently used
+    cache.set(["third"], payload)
+
+    assert cache.get(["second"]) is None
+    assert cache.get(["first"]) is not None
+    assert cache.get(["third"]) is not None
+    assert len(list(tmp_path.glob("*.npz"))) == 2
+
+
+def test_corrupted_entry(tmp_path):
+    cache = ResultsCache(tmp_path)
+    cache.set(["key"], {"values": np.ones(10)})
+    path = cache._get_path(["key"])
+    path.write_bytes(path.read_bytes()[:20])
+
+    # The corrupted entry is dropped and recomputed.
+    assert cache.get(["key"]) is None
+    assert not path.exists()
+    assert cache.get_or_compute(["key"], lambda: {"value": 2}) == {"value": 2}
+    assert cache.get(["key"]) == {"value": 2}
+
+
+def test_clear(tmp_path):
+    cache = ResultsCache(tmp_path)
+    cache.set(["key"], {"value": 1})
+    cache.clear()
+    assert cache.get(["key"]) is None
@@ -0,0 +1,109 @@
+import time
+from queue import Empty, Queue
+from threading import Event
+
+import pytest
+
+pytest.importorskip("aiida.tools.pytest_fixtures")
+
+import kiwipy  # noqa: E402
+from aiida.orm import WorkflowNode  # noqa: E402
+from aiida.tools.pytest_fixtures import *  # noqa: E402,F401,F403
+
+from aiidalab_qe.events import ProcessEventHub  # noqa: E402
+
+
+class RecordingEvent(Event):
+    """Event that records the timeouts it is waited for, i.e., the poll intervals."""
+
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def wait(self, timeout=None):
+        self.timeouts.append(timeout)
+        return super().wait(timeout)
+
+
+def get_events(events, timeout=5):
+    """Return the union of the sets of pks received within ``timeout`` seconds."""
+    pks = events.get(timeout=timeout)
+    while not events.empty():
+        pks |= events.get()
+    return pks
+
+
+@pytest.fixture
+def communicator():
+    communicator = kiwipy.LocalCommunicator()
+    yield communicator
+    communicator.close()
+
+
+def test_broadcast_subscription(communicator):
+    hub = ProcessEventHub(communicator=communicator)
+    events, process_events = Queue(), Queue()
+    hub.subscribe(events.put)
+    hub.subscribe(process_events.put, pk=2)
+    try:
+        communicator.broadcast_send(None, sender=1, subject="state_changed.x.y")
+        assert get_events(events) == {1}
+        with pytest.raises(Empty):
+            process_events.get(timeout=0.5)
+
+        communicator.broadcast_send(None, sender=2, subject="state_changed.x.y")
+        assert get_events(events) == {2}
+        assert get_events(process_events) == {2}
+
+        # Other broadcasts are ignored.
+        communicator.broadcast_send(None, sender=3, subject="other")
+        with pytest.raises(Empty):
+            events.get(timeout=0.5)
+    finally:
+        hub.close()
+
+
+def test_broadcast_unsubscribe_on_error(communicator):
+    hub = ProcessEventHub(communicator=communicator)
+    events = Queue()
+
+    def failing(pks):
+        events.put(pks)
+        raise RuntimeError("failed")
+
+    hub.subscribe(failing)
+    try:
+        with pytest.warns(UserWarning, match="unsubscribed"):
+            communicator.broadcast_send(None, sender=1, subject="state_changed.x.y")
+            assert get_events(events) == {1}
+            hub.close()  # waits for the dispatch to complete
+        communicator.broadcast_send(None, sender=2, subject="state_changed.x.y")
+        with pytest.raises(Empty):
+            events.get(timeout=0.5)
+    finally:
+        hub.close()
+
+
+def test_adaptive_poll(aiida_profile_clean):
+    hub = ProcessEventHub(min_poll_interval=0.05, max_poll_interval=0.2)
+    hub._stop = RecordingEvent()
+    events = Queue()
+    node = WorkflowNode().store()
+    hub.subscribe(events.put)
+    try:
+        # The poll interval is doubled while no process changes.
+        while len(hub._stop.timeouts) < 5:
+            time.sleep(0.05)
+        assert hub._stop.timeouts[:5] == [0.05, 0.1, 0.2, 0.2, 0.2]
+        assert events.empty()
+
+        node.set_process_state("running")
+        assert get_events(events) == {node.pk}
+
+        # The poll interval is reset once a process changed.
+        num_polls = len(hub._stop.timeouts)
+        while len(hub._stop.timeouts) < num_polls + 2:
+            time.sleep(0.05)
+        assert 0.05 in hub._stop.timeouts[num_polls - 1 :]
+    finally:
+        hub.close()
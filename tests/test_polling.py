@@ -0,0 +1,96 @@
+import time
+from threading import Event
+
+from aiidalab_qe.polling import PollResult, PollScheduler
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_get_next_interval():
+    scheduler = PollScheduler(min_interval=0.5, max_interval=3, waiting_interval=30)
+
+    # The interval is doubled while the source is unchanged, up to the maximum.
+    intervals = [None]
+    for _ in range(5):
+        intervals.append(
+            scheduler.get_next_interval(PollResult.UNCHANGED, intervals[-1])
+        )
+    assert intervals[1:] == [0.5, 1, 2, 3, 3]
+
+    assert scheduler.get_next_interval(PollResult.CHANGED, 3) == 0.5
+    assert scheduler.get_next_interval(PollResult.WAITING, 0.5) == 30
+    assert scheduler.get_next_interval(PollResult.WAITING, None) == 30
+
+
+def test_backoff():
+    scheduler = PollScheduler(min_interval=0.05, max_interval=0.2)
+    times = []
+
+    def poll():
+        times.append(time.monotonic())
+        return PollResult.UNCHANGED if len(times) < 5 else PollResult.DONE
+
+    scheduler.add(poll)
+    wait_for(lambda: len(times) == 5)
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    for gap, interval in zip(gaps, [0.1, 0.2, 0.2, 0.2]):
+        assert gap >= interval * 0.9
+
+
+def test_waiting():
+    scheduler = PollScheduler(min_interval=0.01, waiting_interval=0.5)
+    times = []
+
+    def poll():
+        times.append(time.monotonic())
+        return PollResult.WAITING if len(times) < 2 else PollResult.DONE
+
+    scheduler.add(poll)
+    wait_for(lambda: len(times) == 2)
+    assert times[1] - times[0] >= 0.45
+
+
+def test_done():
+    scheduler = PollScheduler(min_interval=0.01)
+    calls = []
+    done = Event()
+
+    def poll():
+        calls.append(None)
+        done.set()
+        return PollResult.DONE
+
+    scheduler.add(poll)
+    assert done.wait(5)
+    time.sleep(0.2)
+    # The source is not polled again, nor scheduled.
+    assert len(calls) == 1
+    assert not scheduler._queue
+
+
+def test_cancel():
+    scheduler = PollScheduler(min_interval=0.01)
+    calls = []
+    task = scheduler.add(lambda: calls.append(None) or PollResult.CHANGED)
+    wait_for(lambda: calls)
+    task.cancel()
+    time.sleep(0.1)
+    num_calls = len(calls)
+    time.sleep(0.2)
+    assert len(calls) == num_calls
+
+
+def test_max_polls_per_second():
+    scheduler = PollScheduler(max_workers=4, max_polls_per_second=20)
+    times = []
+    for _ in range(10):
+        scheduler.add(lambda: times.append(time.monotonic()) or PollResult.DONE)
+    wait_for(lambda: len(times) == 10)
+    # The polls that are all due at once are started at most 20 per second.
+    times.sort()
+    assert times[-1] - times[0] >= 9 / 20 * 0.9
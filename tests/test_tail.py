@@ -0,0 +1,137 @@
+import time
+
+import pytest
+
+pytest.importorskip("aiida.tools.pytest_fixtures")
+
+from aiida.orm import User  # noqa: E402
+from aiida.tools.pytest_fixtures import *  # noqa: E402,F401,F403
+
+from aiidalab_qe.tail import OutputTail, TransportPool, read_remote_tail  # noqa: E402
+
+
+@pytest.fixture
+def local_authinfo(aiida_localhost):
+    return aiida_localhost.get_authinfo(User.collection.get_default())  # noqa: F405
+
+
+def read(tail, path):
+    with open(path, "rb") as handle:
+        return tail.read(handle)
+
+
+def test_output_tail(tmp_path):
+    path = tmp_path / "aiida.out"
+    path.write_bytes(b"first\nsec")
+    tail = OutputTail()
+    assert read(tail, path) == (False, ["first"])
+
+    # The partial line is returned once it is completed.
+    with open(path, "ab") as handle:
+        handle.write(b"ond\nthird")
+    assert read(tail, path) == (False, ["second"])
+    assert read(tail, path) == (False, [])
+    assert tail.flush() == ["third"]
+
+
+def test_output_tail_truncated(tmp_path):
+    path = tmp_path / "aiida.out"
+    path.write_bytes(b"first\nsecond\n")
+    tail = OutputTail()
+    assert read(tail, path) == (False, ["first", "second"])
+
+    path.write_bytes(b"new\n")
+    assert read(tail, path) == (True, ["new"])
+
+
+def test_output_tail_replaced(tmp_path):
+    path = tmp_path / "aiida.out"
+    path.write_bytes(b"run 1\n")
+    tail = OutputTail()
+    assert read(tail, path) == (False, ["run 1"])
+
+    # The file is replaced by a larger one before it is read again.
+    replaced = tmp_path / "aiida.out.new"
+    replaced.write_bytes(b"run 2\nmore output\n")
+    replaced.replace(path)
+    assert read(tail, path) == (True, ["run 2", "more output"])
+
+
+def test_read_remote_tail(local_authinfo, tmp_path):
+    path = tmp_path / "aiida.out"
+    path.write_bytes(b"first\nsec")
+    tail = OutputTail()
+    pool = TransportPool()
+    try:
+        with pool.get_transport(local_authinfo) as transport:
+            assert read_remote_tail(transport, path, tail) == (False, ["first"])
+
+            with open(path, "ab") as handle:
+                handle.write(b"ond\n")
+            assert read_remote_tail(transport, path, tail) == (False, ["second"])
+
+            path.write_bytes(b"new\n")
+            assert read_remote_tail(transport, path, tail) == (True, ["new"])
+
+            with pytest.raises(OSError):
+                read_remote_tail(transport, tmp_path / "missing.out", tail)
+    finally:
+        pool.close_all()
+
+
+def test_transport_pool(local_authinfo):
+    pool = TransportPool()
+    try:
+        with pool.get_transport(local_authinfo) as transport:
+            assert transport.is_open
+        with pool.get_transport(local_authinfo) as other:
+            assert other is transport
+    finally:
+        pool.close_all()
+    assert not transport.is_open
+
+
+def test_transport_pool_close_idle(local_authinfo):
+    pool = TransportPool(idle_timeout=0)
+    try:
+        with pool.get_transport(local_authinfo) as transport:
+            # Transports that are checked out are not closed.
+            with pool._lock:
+                pool._close_idle()
+            assert transport.is_open
+
+        with pool._lock:
+            pool._close_idle()
+        assert not transport.is_open
+
+        with pool.get_transport(local_authinfo) as other:
+            assert other is not transport
+            assert other.is_open
+    finally:
+        pool.close_all()
+
+
+def test_transport_pool_close_idle_timer(local_authinfo):
+    pool = TransportPool(idle_timeout=0.2)
+    try:
+        with pool.get_transport(local_authinfo) as transport:
+            pass
+        assert transport.is_open
+        time.sleep(1)
+        assert not transport.is_open
+        assert not pool._transports
+    finally:
+        pool.close_all()
+
+
+def test_transport_pool_keep_open_on_missing_file(local_authinfo, tmp_path):
+    pool = TransportPool()
+    try:
+        with pool.get_transport(local_authinfo) as transport:
+            with pytest.raises(OSError):
+                read_remote_tail(transport, tmp_path / "missing.out", OutputTail())
+        with pool.get_transport(local_authinfo) as other:
+            assert other is transport
+            assert transport.is_open
+    finally:
+        pool.close_all()